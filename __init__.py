@@ -1,6 +1,9 @@
+import configparser
+import functools
 import os
 from pathlib import Path
 import sys
+import time
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -13,25 +16,95 @@ region_aliases = {
 	'ue2': 'us-east-2'
 }
 
-def get_default_region():
-	with open(Path.home() / '.aws/config', 'r') as config_file:
-		for line in config_file:
-			if 'region' in line:
-				region = line.split('=')[1].strip()
-				return region
+@functools.lru_cache(maxsize=None)
+def get_default_region(profile=None):
+	region = os.environ.get('AWS_REGION', os.environ.get('AWS_DEFAULT_REGION'))
+	if region:
+		return region
+
+	config = configparser.ConfigParser()
+	config.read(Path.home() / '.aws/config')
+
+	section = 'default' if profile in (None, 'default') else f'profile {profile}'
+	if config.has_option(section, 'region'):
+		return config.get(section, 'region')
+
+	## Fall back to the first region in the file
+	for section in config.sections():
+		if config.has_option(section, 'region'):
+			return config.get(section, 'region')
+
+def parse_regions(region):
+	"""
+	Full names of the regions a --region value selects: a region name or
+	abbreviation, a comma separated list of them or 'all'. Returns None if a
+	region is unknown or no region is configured at all.
+	"""
+	if region is None:
+		return None
+
+	region_names = sorted(set(region_aliases.values())) if region == 'all' else region.split(',')
+	try:
+		return [region_aliases[name] for name in region_names]
+	except KeyError:
+		return None
 
 def main(args):
+	## A running daemon executes the command with its warm state
+	if not args or args[0] != 'daemon':
+		from manec2.utils.daemon_client import forward_to_daemon
+		exit_code = forward_to_daemon(args)
+		if exit_code is not None:
+			sys.exit(exit_code)
+
+	run(args)
+
+def run(args):
+	start = time.perf_counter()
 	from manec2.core.base import parse
 	options = parse(args)
 
+	if options.trace is not None:
+		from manec2.utils.trace import record_span, start_trace
+		start_trace(options.trace, origin=start)
+		record_span('parse arguments', 'phase', start, argv=args)
+
 	if options.region is None:
-		options.region = get_default_region()
+		options.region = get_default_region(getattr(options, 'profile', None))
 
-	try:
-		options.region = region_aliases[options.region]
-	except KeyError as e:
+	options.regions = parse_regions(options.region)
+	if options.regions is None:
 		print(f'Specified region not found, check the region name or abbreviation')
 		sys.exit(33)
 
-	if 'command' in options:
-		options.command(options)
+	if len(options.regions) > 1 and not getattr(options, 'multi_region', False):
+		print(f'This command runs against a single region')
+		sys.exit(33)
+
+	options.region = options.regions[0]
+
+	if 'command' not in options:
+		return
+
+	from manec2.utils.rate_limiter import report_throttling, throttle_code
+	try:
+		if options.trace is None:
+			options.command(options)
+			return
+
+		from manec2.utils.trace import finish_trace, span
+		try:
+			with span(options.command_name + ' ' + options.command.__name__.replace('_command', ''),
+				'command'):
+				options.command(options)
+		finally:
+			finish_trace()
+	except Exception as e:
+		## Every retry of a call was throttled, the account is over its API rate
+		code = throttle_code(getattr(e, 'response', None))
+		if code is None:
+			raise
+		print(f'AWS is throttling requests ({code}), retry later or with a lower --max-parallel')
+		sys.exit(34)
+	finally:
+		report_throttling()
@@ -1,140 +1,130 @@
-import boto3
-import json
-import os
-import time
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 import manec2
-from manec2.utils.instance_type import Instance
-
-def query_ctx_instance_info(region, instance_ids, ssh_user='ubuntu', ssh_key='~/.ssh/john.pem'):
+from manec2.utils.aws_session import get_client
+from manec2.utils.constants import DESCRIBE_BATCH_SIZE
+from manec2.utils.executor import output_mode, report_results, run_on_hosts
+from manec2.utils.instance_type import parse_instance
+from manec2.utils.ssh_mux import ssh_mux_options
+from manec2.utils.load_defaults import get_ssh_options
+from manec2.utils.waiter import describe_instance_ids
+
+MAX_DESCRIBE_WORKERS = 8
+
+def query_ctx_instance_info(profile, region, instance_ids):
+	"""
+	Describe instance_ids in concurrent chunks and return them sorted by ID.
+	Members EC2 doesn't know yet or any more are left out.
+	"""
 	if not instance_ids:
 		return []
 
-	ec2_cli = boto3.client('ec2', region_name=region)
-	response = ec2_cli.describe_instances(InstanceIds=instance_ids)
-
-	instances = []
-	for res in response['Reservations']:
-		for inst in res['Instances']:
-			inst_id = inst['InstanceId']
-			inst_type = inst['InstanceType']
-			inst_place = inst['Placement']['AvailabilityZone']
-			state = inst['State']['Name']
-			prip = '0'
-			pubip = '0'
-			dns = '0'
-			try:
-				prip = inst['PrivateIpAddress']
-			except KeyError as e:
-				## This is probably terminating. Just skip it
-				continue
-			if state ==  'running':
-				pubip = inst['PublicIpAddress']
-				dns = inst['PublicDnsName']
-			instances.append(Instance(inst_id, inst_type, inst_place, prip, pubip,
-				dns, state, ssh_user, ssh_key))
+	ec2_cli = get_client(profile, region)
+	batches = [instance_ids[i:i + DESCRIBE_BATCH_SIZE] \
+			   for i in range(0, len(instance_ids), DESCRIBE_BATCH_SIZE)]
+
+	with ThreadPoolExecutor(max_workers=min(MAX_DESCRIBE_WORKERS, len(batches))) as pool:
+		instances = [parse_instance(inst) for batch in pool.map(
+			lambda batch: describe_instance_ids(ec2_cli, batch), batches) for inst in batch]
 
+	## Without a private IP the instance is terminating, skip it
+	instances = [inst for inst in instances if inst.pr_ip != '0']
 	instances.sort(key=lambda x : x.id)
 	return instances
 
-def list_groups(options):
-	asg = boto3.client('autoscaling')
-	response = asg.describe_auto_scaling_groups()
+def describe_groups(options, group_names=None):
+	"""
+	Page through describe_auto_scaling_groups, for group_names or every group.
+	"""
+	asg = get_client(options.profile, options.region, 'autoscaling')
+	paginator = asg.get_paginator('describe_auto_scaling_groups')
+	params = { 'AutoScalingGroupNames': group_names } if group_names else {}
+
+	groups = []
+	for page in paginator.paginate(**params):
+		groups += page['AutoScalingGroups']
+
+	return groups
+
+def query_group_instance_info(options, group_name):
+	"""
+	Resolve the members of an auto scaling group into Instance objects sorted
+	by ID.
+	"""
+	groups = describe_groups(options, [group_name])
+	if not groups:
+		print(f'Auto scaling group {group_name} not found')
+		exit(13)
 
-	for group in response['AutoScalingGroups']:
-		print(group['AutoScalingGroupName'])
+	instance_ids = [inst['InstanceId'] for inst in groups[0]['Instances']]
+	return query_ctx_instance_info(options.profile, options.region, instance_ids)
 
-def ssh_command(options):
-	asg = boto3.client('autoscaling')
-	asg_response = asg.describe_auto_scaling_groups(
-		AutoScalingGroupNames=[options.auto_scaling_group_name])['AutoScalingGroups'][0]['Instances']
-	instance_ids = []
-	if options.all:
-		instance_ids = sorted([inst['InstanceId'] for inst in asg_response])
+def _select_running_instances(options, use_all):
+	instances = query_group_instance_info(options, options.auto_scaling_group_name)
+	if use_all:
+		selected = list(enumerate(instances))
 	else:
-		instance_ids = sorted([inst['InstanceId'] for i, inst in enumerate(asg_response) if i in options.indices])
-
-	instances = query_ctx_instance_info(options.region, instance_ids)
-	instances = [inst for inst in instances if inst.last_observed_state == 'running']
+		selected = [(i, instances[i]) for i in options.indices if i < len(instances)]
 
-	if len(instances) == 0:
+	selected = [(i, inst) for i, inst in selected if inst.last_observed_state == 'running']
+	if len(selected) == 0:
 		print(f'No running instances in context {options.auto_scaling_group_name}')
 		exit(13)
 
-	ssh_user = instances[0].user
-	if options.user != '':
-		ssh_user = options.user
+	return selected
 
-	ssh_key = instances[0].key
-	if options.key != '':
-		ssh_key = options.key
+def list_groups(options):
+	for group in describe_groups(options):
+		print(group['AutoScalingGroupName'])
+
+def ssh_command(options):
+	selected = _select_running_instances(options, options.all)
+
+	ssh_user, ssh_key = get_ssh_options(options)
 
 	remote_access_opts = []
 	if ssh_key != '':
 		remote_access_opts = ['-i', ssh_key]
+	remote_access_opts = remote_access_opts + ssh_mux_options(options)
 
-	processes = []
-	for inst in instances:
+	host_commands = []
+	for i, inst in selected:
 		ssh_command = ['ssh'] + remote_access_opts \
 			+ [ssh_user + '@' + inst.dns] \
 			+ options.comm.split()
 
-		if options.parallel:
-			processes.append(subprocess.Popen(ssh_command))
-		else:
-			subprocess.run(ssh_command)
+		host_commands.append((i, inst.dns, [ssh_command]))
 
-	for proc in processes:
-		proc.wait()
+	results = run_on_hosts(host_commands, options.parallel, options.max_parallel,
+		output_mode(options, len(host_commands)))
+	report_results(results, options.parallel)
 
 def scp_command(options):
-	asg = boto3.client('autoscaling')
-	asg_response = asg.describe_auto_scaling_groups(
-		AutoScalingGroupNames=[options.auto_scaling_group_name])['AutoScalingGroups'][0]['Instances']
-	instance_ids = []
-	if options.all:
-		instance_ids = sorted([inst['InstanceId'] for inst in asg_response])
-	else:
-		instance_ids = sorted([inst['InstanceId'] for i, inst in enumerate(asg_response) if i in options.indices])
-
-	instances = query_ctx_instance_info(options.region, instance_ids)
-	instances = [inst for inst in instances if inst.last_observed_state == 'running']
+	selected = _select_running_instances(options, options.all)
 
-	if len(instances) == 0:
-		print(f'No running instances in context {options.auto_scaling_group_name}')
-		exit(13)
-
-	ssh_user = instances[0].user
-	if options.user != '':
-		ssh_user = options.user
-
-	ssh_key = instances[0].key
-	if options.key != '':
-		ssh_key = options.key
+	ssh_user, ssh_key = get_ssh_options(options)
 
 	remote_access_opts = []
 	if ssh_key != '':
 		remote_access_opts = ['-i', ssh_key]
+	remote_access_opts = remote_access_opts + ssh_mux_options(options)
 
-	processes = []
-	for inst in instances:
+	host_commands = []
+	for i, inst in selected:
 		scp_cmd = ['scp'] + remote_access_opts
 		if options.put:
 			scp_cmd = scp_cmd + [options.file, f'{ssh_user}@{inst.dns}:{options.location}']
 		elif options.get:
 			scp_cmd = scp_cmd + [f'{ssh_user}@{inst.dns}:{options.file}', options.location]
 
-		if options.parallel:
-			processes.append(subprocess.Popen(scp_cmd))
-		else:
-			subprocess.run(scp_cmd)
+		host_commands.append((i, inst.dns, [scp_cmd]))
 
-	for proc in processes:
-		proc.wait()
+	results = run_on_hosts(host_commands, options.parallel, options.max_parallel,
+		output_mode(options, len(host_commands)))
+	report_results(results, options.parallel)
 
 def scale_group(options):
-	asg = boto3.client('autoscaling')
+	asg = get_client(options.profile, options.region, 'autoscaling')
 	asg.set_desired_capacity(
 		AutoScalingGroupName=options.auto_scaling_group_name,
 		DesiredCapacity=options.size
@@ -143,12 +133,9 @@ def scale_group(options):
 	print(f'Setting desired capacity of {options.auto_scaling_group_name} to {options.size}')
 
 def group_info(options):
-	asg = boto3.client('autoscaling')
-	response = asg.describe_auto_scaling_groups(AutoScalingGroupNames=options.auto_scaling_group_names)
-
-	for as_group in response['AutoScalingGroups']:
+	for as_group in describe_groups(options, options.auto_scaling_group_names):
 		name = as_group['AutoScalingGroupName']
-		instances = as_group['Instances']
+		instances = sorted(as_group['Instances'], key=lambda x : x['InstanceId'])
 		print(f'Auto Scaling Group {name}\n{len(instances)} instances')
 		for i, inst in enumerate(instances):
 			print("  {:2d}  {}  {}  {}  {}".format(i, inst['InstanceId'],
@@ -158,63 +145,43 @@ def group_info(options):
 		print()
 
 def rsync_group_command(options):
-	asg = boto3.client('autoscaling')
-	asg_response = asg.describe_auto_scaling_groups(
-		AutoScalingGroupNames=[options.auto_scaling_group_name])['AutoScalingGroups'][0]['Instances']
-	instance_ids = []
-	if options.indices == -1:
-		instance_ids = sorted([inst['InstanceId'] for inst in asg_response])
-	else:
-		instance_ids = sorted([inst['InstanceId'] for i, inst in enumerate(asg_response) if i in options.indices])
-
-	instances = query_ctx_instance_info(options.region, instance_ids)
-	instances = [inst for inst in instances if inst.last_observed_state == 'running']
+	selected = _select_running_instances(options, options.indices == -1)
 
-	if len(instances) == 0:
-		print(f'No running instances in context {options.auto_scaling_group_name}')
-		exit(13)
-
-	ssh_user = instances[0].user
-	if options.user != '':
-		ssh_user = options.user
-
-	ssh_key = instances[0].key
-	if options.key != '':
-		ssh_key = options.key
+	ssh_user, ssh_key = get_ssh_options(options)
 
 	remote_access_opts = []
 	if ssh_key != '':
 		remote_access_opts = ['-i', ssh_key]
+	remote_access_opts = remote_access_opts + ssh_mux_options(options)
 
-	confirmed = False
-	processes = []
-	for inst in instances:
+	if options.force:
+		confirm = input("Are you sure you want to run 'rm -rf' on '"
+			+ options.location + "'? (yes/no)\n")
+		if confirm != 'yes':
+			return
+
+	exclusions = ['--exclude'] + ' --exclude '.join(options.exclude).split() \
+		if len(options.exclude) != 0 else []
+
+	host_commands = []
+	for i, inst in selected:
+		commands = []
 		if options.force:
 			delete_dir_command = 'rm -rf ' + options.location
 			create_dir_command = 'mkdir -p ' + options.location
 			ssh_command_base = ['ssh'] + remote_access_opts \
 				+ [ssh_user + '@' + inst.dns]
-			if not confirmed:
-				confirm = input("Are you sure you want to run 'rm -rf' on '"
-					+ options.location + "'? (yes/no)\n")
-				confirmed = confirm == 'yes'
-			if confirmed:
-				subprocess.run(ssh_command_base + delete_dir_command.split())
-				subprocess.run(ssh_command_base + create_dir_command.split())
-			else:
-				return
-
-		exclusions = ['--exclude'] + ' --exclude '.join(options.exclude).split() \
-			if len(options.exclude) != 0 else []
+			commands.append(ssh_command_base + delete_dir_command.split() + ['&&'] \
+				+ create_dir_command.split())
+
 		rsync_command = ['rsync', '-auzh', '-zz'] \
 			+ ['-e'] + [' '.join(["ssh"] + remote_access_opts)] \
 			+ exclusions + [options.file] \
 			+ [ssh_user + '@' + inst.dns+ ":" + options.location]
+		commands.append(rsync_command)
 
-		if options.parallel:
-			processes.append(subprocess.Popen(rsync_command))
-		else:
-			subprocess.run(rsync_command)
+		host_commands.append((i, inst.dns, commands))
 
-	for proc in processes:
-		proc.wait()
\ No newline at end of file
+	results = run_on_hosts(host_commands, options.parallel, options.max_parallel,
+		output_mode(options, len(host_commands)))
+	report_results(results, options.parallel)
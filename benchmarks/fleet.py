@@ -0,0 +1,239 @@
+"""
+Offline fleet benchmark for the manec2 CLI.
+
+Runs `ec2 info`, `ssh -p`, `scp`, `rsync` and the lifecycle commands against
+contexts of increasing size. EC2 is simulated in-process by moto and
+ssh/scp/rsync are replaced by a fake transport that only records that it was
+spawned, so no AWS account, credentials or hosts are involved. Every command
+is timed and its EC2 API calls and spawned transport processes are counted.
+Results are written as JSON, and can be compared against an earlier result file
+to flag regressions.
+
+	python -m manec2.benchmarks.fleet [--sizes N ...] [--output FILE]
+		[--baseline FILE] [--tolerance RATIO]
+
+Requires moto (pip install 'moto[ec2]').
+"""
+import argparse
+import collections
+import contextlib
+import io
+import json
+import os
+import platform
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+import manec2
+
+DEFAULT_SIZES = [10, 100, 1000, 5000]
+BENCH_REGION = 'us-west-2'
+
+## Largest number of instances seeded with one run_instances call
+SEED_BATCH = 1000
+
+## A command is reported as a regression when it is this much slower than the baseline,
+## and by more than MIN_REGRESSION seconds so millisecond noise is ignored
+DEFAULT_TOLERANCE = 1.5
+MIN_REGRESSION = 0.05
+
+FAKE_TRANSPORT = '#!/bin/sh\necho "$(basename "$0")" >> "$MANEC2_BENCH_SPAWNS"\nexit 0\n'
+
+def _bench_commands(ctx, payload):
+	"""
+	(name, args, stdin) for every benchmarked command, in the order they run.
+	"""
+	return [
+		('info', ['ec2', 'info', ctx, '--refresh'], ''),
+		('info (cached)', ['ec2', 'info', ctx], ''),
+		('ssh -p', ['ec2', 'ssh', ctx, '--all', '-p', '-c', 'true'], ''),
+		('scp --put', ['ec2', 'scp', ctx, payload, '--put', '-l', '/tmp', '-p'], ''),
+		('rsync', ['ec2', 'rsync', ctx, '-f', payload, '-l', '/tmp', '-p'], ''),
+		('reboot', ['ec2', 'reboot', ctx], ''),
+		('stop', ['ec2', 'stop', ctx], ''),
+		('start', ['ec2', 'start', ctx], ''),
+		('terminate', ['ec2', 'terminate', ctx], 'terminate\n')
+	]
+
+def _seed_home(home):
+	os.makedirs(os.path.join(home, '.aws'))
+	with open(os.path.join(home, '.aws', 'config'), 'w') as config_file:
+		config_file.write(f'[default]\nregion = {BENCH_REGION}\n')
+
+	key_path = os.path.join(home, 'bench.pem')
+	open(key_path, 'w').close()
+	with open(os.path.join(home, '.manec2_config.yaml'), 'w') as config_file:
+		config_file.write('default:\n'
+			'  KeyPair: bench\n'
+			'  SecurityGroups: [bench]\n'
+			'  SSHOptions:\n'
+			'    User: ubuntu\n'
+			'    Keys:\n'
+			f'      {BENCH_REGION}: {key_path}\n')
+
+	bin_dir = os.path.join(home, 'bin')
+	os.makedirs(bin_dir)
+	for name in ('ssh', 'scp', 'rsync'):
+		path = os.path.join(bin_dir, name)
+		with open(path, 'w') as transport_file:
+			transport_file.write(FAKE_TRANSPORT)
+		os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+
+	payload = os.path.join(home, 'payload.bin')
+	with open(payload, 'wb') as payload_file:
+		payload_file.write(os.urandom(64 * 1024))
+
+	return bin_dir, payload
+
+def _seed_context(ctx, size):
+	import boto3
+	ec2_cli = boto3.client('ec2', region_name=BENCH_REGION)
+	image_id = ec2_cli.describe_images()['Images'][0]['ImageId']
+
+	for start in range(0, size, SEED_BATCH):
+		count = min(SEED_BATCH, size - start)
+		ec2_cli.run_instances(ImageId=image_id, InstanceType='c5.large',
+			MinCount=count, MaxCount=count,
+			TagSpecifications=[{
+				'ResourceType': 'instance',
+				'Tags': [{ 'Key': 'Name', 'Value': ctx }]
+			}])
+
+class _ApiCounter:
+	"""
+	Counts the EC2 API calls made by manec2's shared boto3 session.
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.calls = collections.Counter()
+
+	def __call__(self, model, **kwargs):
+		with self.lock:
+			self.calls[model.name] += 1
+
+	def take(self):
+		with self.lock:
+			calls, self.calls = self.calls, collections.Counter()
+
+		return dict(calls)
+
+def _run_command(args, stdin, spawn_log):
+	open(spawn_log, 'w').close()
+
+	exit_code = 0
+	sys.stdin = io.StringIO(stdin)
+	start = time.perf_counter()
+	try:
+		with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+			manec2.main(args)
+	except SystemExit as e:
+		exit_code = e.code if isinstance(e.code, int) else 1
+	elapsed = time.perf_counter() - start
+	sys.stdin = sys.__stdin__
+
+	with open(spawn_log) as spawn_file:
+		processes = sum(1 for _ in spawn_file)
+
+	return elapsed, exit_code, processes
+
+def _compare(results, baseline_path, tolerance):
+	"""
+	Print the ratio of every timing to the baseline. Returns the number of
+	commands that regressed.
+	"""
+	with open(baseline_path) as baseline_file:
+		baseline = { (r['size'], r['command']): r for r in json.load(baseline_file)['results'] }
+
+	regressions = 0
+	print(f'\nCompared with {baseline_path}:')
+	for result in results:
+		previous = baseline.get((result['size'], result['command']))
+		if previous is None or previous['seconds'] == 0:
+			continue
+
+		ratio = result['seconds'] / previous['seconds']
+		regressed = ratio > tolerance and result['seconds'] - previous['seconds'] > MIN_REGRESSION
+		regressions += regressed
+		calls = result['api_calls'] - previous['api_calls']
+		processes = result['processes'] - previous['processes']
+		print(f"  {result['size']:>5}  {result['command']:14}  {ratio:5.2f}x"
+			f"  api {calls:+d}  procs {processes:+d}  {'REGRESSION' if regressed else ''}")
+
+	return regressions
+
+def main(args):
+	parser = argparse.ArgumentParser(prog='manec2.benchmarks.fleet')
+	parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+	parser.add_argument('--output', '-o', type=str, default='manec2-fleet-bench.json')
+	parser.add_argument('--baseline', type=str, default=None,
+		help='Earlier result file to compare against')
+	parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+	options = parser.parse_args(args)
+
+	try:
+		from moto import mock_aws
+	except ImportError:
+		print("The fleet benchmark needs moto, install it with pip install 'moto[ec2]'")
+		sys.exit(2)
+
+	results = []
+	with tempfile.TemporaryDirectory() as home:
+		bin_dir, payload = _seed_home(home)
+		spawn_log = os.path.join(home, 'spawns.log')
+
+		os.environ.update({
+			'HOME': home,
+			'PATH': bin_dir + os.pathsep + os.environ.get('PATH', ''),
+			'MANEC2_BENCH_SPAWNS': spawn_log,
+			'AWS_ACCESS_KEY_ID': 'bench',
+			'AWS_SECRET_ACCESS_KEY': 'bench',
+			'AWS_DEFAULT_REGION': BENCH_REGION
+		})
+		for name in ('AWS_PROFILE', 'AWS_REGION', 'AWS_SESSION_TOKEN'):
+			os.environ.pop(name, None)
+
+		with mock_aws():
+			from manec2.utils.aws_session import get_session
+			counter = _ApiCounter()
+			## Clients copy the session's handlers, register before any is created
+			get_session(None).events.register('before-call.ec2', counter)
+
+			for size in options.sizes:
+				ctx = f'bench-{size}'
+				_seed_context(ctx, size)
+
+				for name, command_args, stdin in _bench_commands(ctx, payload):
+					counter.take()
+					elapsed, exit_code, processes = _run_command(command_args, stdin, spawn_log)
+					calls = counter.take()
+					results.append({
+						'size': size,
+						'command': name,
+						'seconds': round(elapsed, 4),
+						'api_calls': sum(calls.values()),
+						'api_calls_by_operation': calls,
+						'processes': processes,
+						'exit_code': exit_code
+					})
+					print(f'{size:>5}  {name:14}  {elapsed * 1000:9.1f} ms  '
+						f'{sum(calls.values()):4d} api calls  {processes:5d} processes'
+						+ (f'  exit {exit_code}' if exit_code else ''))
+
+	with open(options.output, 'w') as output_file:
+		json.dump({
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'timestamp': time.time(),
+			'results': results
+		}, output_file, indent=2)
+	print(f'Results written to {options.output}')
+
+	failed = any(result['exit_code'] for result in results)
+	regressions = _compare(results, options.baseline, options.tolerance) if options.baseline else 0
+	sys.exit(1 if failed or regressions else 0)
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,90 @@
+"""
+Startup time budget for the manec2 CLI.
+
+Times `manec2 --help` and an `ec2 info` served from the inventory cache in fresh
+interpreters, against a throwaway HOME so no AWS credentials or API calls are
+involved. Exits non-zero if the median of either run is over its budget.
+
+	python -m manec2.benchmarks.startup [--runs N]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import manec2
+from manec2.utils.inventory_cache import CACHE_VERSION
+
+## Seconds, median over all runs
+HELP_BUDGET = 0.25
+CACHED_INFO_BUDGET = 0.35
+
+BENCH_CTX = 'startup-bench'
+BENCH_REGION = 'us-west-2'
+
+def _seed_home(home, instances=64):
+	os.makedirs(os.path.join(home, '.aws'))
+	with open(os.path.join(home, '.aws', 'config'), 'w') as config_file:
+		config_file.write(f'[default]\nregion = {BENCH_REGION}\n')
+
+	records = [{
+		'id': f'i-{i:017x}',
+		'type': 'c5.large',
+		'placement': f'{BENCH_REGION}a',
+		'pr_ip': f'10.0.{i // 256}.{i % 256}',
+		'pub_ip': f'54.0.{i // 256}.{i % 256}',
+		'dns': f'ec2-54-0-{i // 256}-{i % 256}.compute.amazonaws.com',
+		'last_observed_state': 'running',
+		'placement_group': ''
+	} for i in range(instances)]
+
+	cache = {
+		f'default/{BENCH_REGION}/{BENCH_CTX}': {
+			'timestamp': time.time(),
+			'version': CACHE_VERSION,
+			'instances': records
+		}
+	}
+	with open(os.path.join(home, '.manec2_cache.json'), 'w') as cache_file:
+		json.dump(cache, cache_file)
+
+def _time_command(args, env, runs):
+	timings = []
+	for _ in range(runs):
+		start = time.perf_counter()
+		subprocess.run([sys.executable, '-m', 'manec2'] + args, env=env, check=True,
+			stdout=subprocess.DEVNULL)
+		timings.append(time.perf_counter() - start)
+
+	return statistics.median(timings)
+
+def main(args):
+	parser = argparse.ArgumentParser(prog='manec2.benchmarks.startup')
+	parser.add_argument('--runs', type=int, default=10)
+	options = parser.parse_args(args)
+
+	with tempfile.TemporaryDirectory() as home:
+		_seed_home(home)
+		env = dict(os.environ, HOME=home, PYTHONPATH=manec2.BASE_DIR)
+		env.pop('AWS_PROFILE', None)
+
+		checks = [
+			('manec2 --help', ['--help'], HELP_BUDGET),
+			('manec2 ec2 info (cached)', ['ec2', 'info', BENCH_CTX, '--pubip'], CACHED_INFO_BUDGET)
+		]
+
+		over_budget = False
+		for name, command_args, budget in checks:
+			median = _time_command(command_args, env, options.runs)
+			status = 'ok' if median <= budget else 'OVER BUDGET'
+			over_budget = over_budget or median > budget
+			print(f'{name:28}  {median * 1000:7.1f} ms  (budget {budget * 1000:.0f} ms)  {status}')
+
+	sys.exit(1 if over_budget else 0)
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
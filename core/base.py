@@ -1,29 +1,50 @@
 import argparse
-import functools
 import importlib
-import logging
+import os
 import pkgutil
-import subprocess
 
 import manec2
 
+def _command_packages():
+	"""
+	Names of the subpackages that provide a command module. Found by looking at
+	the file system so no command module is imported just to list them.
+	"""
+	for module_info in pkgutil.iter_modules(manec2.__path__):
+		if not module_info.ispkg:
+			continue
+		if os.path.exists(os.path.join(module_info.module_finder.path, module_info.name, 'command.py')):
+			yield module_info.name
+
+def _command_name(args):
+	"""
+	The subpackage named in args, skipping the global options before it.
+	"""
+	i = 0
+	while i < len(args) and args[i].startswith('-'):
+		## --trace FILE takes a value, --help and --trace=FILE don't
+		i += 1 if args[i] in ('-h', '--help') or '=' in args[i] else 2
+
+	return args[i] if i < len(args) else None
+
 def parse(args):
 	parser = argparse.ArgumentParser(prog='manec2',
 					description='EC2 Instance Manager')
 
+	parser.add_argument('--trace', type=str, metavar='FILE', default=None,
+					help='Write a Chrome trace of the command to FILE')
 	subparsers = parser.add_subparsers(metavar='command', dest='command_name')
 
-	# Only one module but extensible in the future
-	for module_info in pkgutil.iter_modules(manec2.__path__):
-		if not module_info.ispkg:
-			continue
-		full_module_name = 'manec2.{}.command'.format(module_info.name)
-		try:
-			module = importlib.import_module(full_module_name)
-		except ModuleNotFoundError as e:
+	# Only the command module of the subpackage being invoked is imported and
+	# gets its arguments registered, the others are listed for --help only
+	command_name = _command_name(args)
+	for name in _command_packages():
+		if name != command_name:
+			subparsers.add_parser(name, help=None)
 			continue
 
-		subparser = subparsers.add_parser(module_info.name, help=module.HELP)
+		module = importlib.import_module('manec2.{}.command'.format(name))
+		subparser = subparsers.add_parser(name, help=module.HELP)
 		module.add_arguments(subparser)
 
 	return parser.parse_args(args)
@@ -0,0 +1,4 @@
+import manec2
+import os
+
+MODULE_BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
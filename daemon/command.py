@@ -0,0 +1,22 @@
+NAME = 'resident daemon'
+HELP = None
+
+def add_arguments(parser):
+	parser.add_argument('--profile', type=str, default=None,
+						help='Profile whose clients are created ahead of time')
+	parser.add_argument('--region', '-r', type=str, default=None)
+	parser.add_argument('action', type=str, nargs='?', default='start',
+						choices=['start', 'run', 'stop', 'status'],
+						help='start in the background, run in the foreground, stop or check it')
+	parser.set_defaults(command=daemon_command)
+
+def daemon_command(options):
+	from .server import daemon_status, run_daemon, start_daemon, stop_daemon
+	if options.action == 'start':
+		start_daemon(options)
+	elif options.action == 'run':
+		run_daemon(options)
+	elif options.action == 'stop':
+		stop_daemon()
+	else:
+		daemon_status()
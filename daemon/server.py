@@ -0,0 +1,258 @@
+"""
+Resident manec2 daemon.
+
+The daemon imports every command module, loads the config and creates the
+boto3 session and clients of a profile once, then listens on a Unix socket in
+the user's home. The manec2 CLI forwards its arguments, environment, working
+directory and stdin/stdout/stderr to it (see utils/daemon_client.py), and the
+daemon forks a worker per command that starts from that warm state.
+"""
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+
+import manec2
+from manec2.utils.daemon_client import daemon_pid_path, daemon_socket_path, source_version
+
+## Largest request read in one go, requests carry the client's environment
+MAX_REQUEST = 1 << 20
+
+def _aws_env(env):
+	## Everything that changes which account, region or credentials boto3 uses
+	return { key: value for key, value in env.items() if key.startswith('AWS_') or key == 'HOME' }
+
+def _mtime(path):
+	try:
+		return os.path.getmtime(path)
+	except OSError:
+		return None
+
+def _config_mtime():
+	from manec2.utils.load_defaults import config_file_path
+	return _mtime(config_file_path)
+
+def _aws_files_mtimes(env):
+	## Rotated keys or a new default region in the shared AWS files
+	aws_dir = os.path.join(env.get('HOME', ''), '.aws')
+	return (_mtime(env.get('AWS_SHARED_CREDENTIALS_FILE', os.path.join(aws_dir, 'credentials'))),
+		_mtime(env.get('AWS_CONFIG_FILE', os.path.join(aws_dir, 'config'))))
+
+class _Handler(socketserver.BaseRequestHandler):
+	"""
+	Runs one forwarded command. Called in a worker forked for the request, so
+	the command can change the process's fds, environment and globals freely.
+	"""
+	def _read_request(self):
+		data, fds, _, _ = socket.recv_fds(self.request, MAX_REQUEST, 3)
+		while data and not data.endswith(b'\n'):
+			chunk = self.request.recv(MAX_REQUEST)
+			if not chunk:
+				break
+			data += chunk
+
+		## Liveness checks connect and hang up without a request
+		if not data or len(fds) != 3:
+			return None, fds
+
+		return json.loads(data), fds
+
+	def _adopt_client(self, request, fds):
+		for target, fd in zip((0, 1, 2), fds):
+			os.dup2(fd, target)
+			os.close(fd)
+		sys.stdin = open(0, 'r', closefd=False)
+		sys.stdout = open(1, 'w', buffering=1 if os.isatty(1) else -1, closefd=False)
+		sys.stderr = open(2, 'w', buffering=1, closefd=False)
+
+		## Warm state built for another account, region or set of credentials can't be reused
+		if _aws_env(request['env']) != self.server.aws_env \
+				or _aws_files_mtimes(request['env']) != self.server.aws_files_mtimes:
+			from manec2.utils.aws_session import reset_sessions
+			reset_sessions()
+			manec2.get_default_region.cache_clear()
+		if _config_mtime() != self.server.config_mtime:
+			from manec2.utils.load_defaults import _load_config
+			_load_config.cache_clear()
+
+		os.environ.clear()
+		os.environ.update(request['env'])
+		os.chdir(request['cwd'])
+
+	def _reply(self, reply):
+		self.request.sendall(json.dumps(reply).encode() + b'\n')
+
+	def handle(self):
+		signal.signal(signal.SIGTERM, signal.SIG_DFL)
+		signal.signal(signal.SIGINT, signal.default_int_handler)
+
+		request, fds = self._read_request()
+		if request is None or request.get('version') != self.server.version:
+			for fd in fds:
+				os.close(fd)
+			## A client of another manec2 version runs the command itself
+			if request is not None:
+				self._reply({ 'stale': self.server.version })
+			return
+
+		self._adopt_client(request, fds)
+		self._reply({ 'pid': os.getpid() })
+
+		exit_code = 0
+		try:
+			manec2.run(request['argv'])
+		except SystemExit as e:
+			if isinstance(e.code, int) or e.code is None:
+				exit_code = e.code or 0
+			else:
+				print(e.code, file=sys.stderr)
+				exit_code = 1
+		except KeyboardInterrupt:
+			exit_code = 130
+		except Exception:
+			traceback.print_exc()
+			exit_code = 1
+		finally:
+			sys.stdout.flush()
+			sys.stderr.flush()
+
+		self._reply({ 'exit': exit_code })
+
+class _Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+	pass
+
+def _warm(options):
+	"""
+	Pay every cost commands share once: imports, argparse modules, the config,
+	the boto3 session with its credentials and the clients' service models.
+	"""
+	import manec2.core.base
+	import manec2.ec2.command
+	import manec2.ec2.instance
+	import manec2.asg.command
+	import manec2.asg.asg
+	from manec2.utils.aws_session import get_client, get_session
+	from manec2.utils.load_defaults import _load_config
+
+	_load_config()
+	for service in ('ec2', 'autoscaling'):
+		get_client(options.profile, options.region, service)
+
+	try:
+		get_session(options.profile).get_credentials()
+	except Exception as e:
+		print(f'Could not resolve AWS credentials yet: {e}')
+
+def _running_pid():
+	"""
+	PID of the daemon answering on the socket, or None.
+	"""
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		sock.connect(str(daemon_socket_path()))
+		return int(daemon_pid_path().read_text())
+	except (OSError, ValueError):
+		return None
+	finally:
+		sock.close()
+
+def run_daemon(options):
+	if _running_pid() is not None:
+		print(f'manec2 daemon is already running (pid {_running_pid()})')
+		exit(19)
+
+	socket_path = daemon_socket_path()
+	if socket_path.exists():
+		socket_path.unlink()
+
+	start = time.monotonic()
+	_warm(options)
+
+	## Only the owner may connect, the socket accepts commands for their account
+	umask = os.umask(0o077)
+	try:
+		server = _Server(str(socket_path), _Handler)
+	finally:
+		os.umask(umask)
+	server.aws_env = _aws_env(os.environ)
+	server.aws_files_mtimes = _aws_files_mtimes(os.environ)
+	server.config_mtime = _config_mtime()
+	server.version = source_version()
+
+	daemon_pid_path().write_text(str(os.getpid()))
+	## Exiting from the handler could land inside a fork hook and be ignored,
+	## stop the serve loop from another thread instead
+	signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+	print(f'manec2 daemon ready on {socket_path} in {time.monotonic() - start:.2f}s (pid {os.getpid()})')
+	sys.stdout.flush()
+
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		socket_path.unlink(missing_ok=True)
+		daemon_pid_path().unlink(missing_ok=True)
+
+def start_daemon(options):
+	"""
+	Run the daemon in the background, detached from the terminal. Its output
+	goes to ~/.manec2_daemon.log.
+	"""
+	if _running_pid() is not None:
+		print(f'manec2 daemon is already running (pid {_running_pid()})')
+		exit(19)
+
+	if os.fork() != 0:
+		## Wait for the socket so the next command is already served by the daemon
+		deadline = time.monotonic() + 30
+		while _running_pid() is None and time.monotonic() < deadline:
+			time.sleep(0.05)
+		daemon_status()
+		return
+
+	os.setsid()
+	if os.fork() != 0:
+		os._exit(0)
+
+	log_path = daemon_socket_path().with_name('.manec2_daemon.log')
+	log_fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+	null_fd = os.open(os.devnull, os.O_RDONLY)
+	os.dup2(null_fd, 0)
+	os.dup2(log_fd, 1)
+	os.dup2(log_fd, 2)
+
+	exit_code = 0
+	try:
+		run_daemon(options)
+	except SystemExit as e:
+		exit_code = e.code if isinstance(e.code, int) else 1
+	except Exception:
+		traceback.print_exc()
+		exit_code = 1
+	finally:
+		sys.stdout.flush()
+		os._exit(exit_code)
+
+def stop_daemon():
+	pid = _running_pid()
+	if pid is None:
+		print('manec2 daemon is not running')
+		return
+
+	os.kill(pid, signal.SIGTERM)
+	print(f'Stopped manec2 daemon (pid {pid})')
+
+def daemon_status():
+	pid = _running_pid()
+	if pid is None:
+		print('manec2 daemon is not running')
+		exit(19)
+
+	print(f'manec2 daemon is running (pid {pid}) on {daemon_socket_path()}')
@@ -1,6 +1,12 @@
 import argparse
-from multiprocessing import parent_process
 
+from manec2.utils.constants import DEFAULT_MAX_PARALLEL, LAUNCH_CHUNK_SIZE, LIFECYCLE_WAIT_TIMEOUT, \
+	OUTPUT_FORMATS, OUTPUT_MODES, SSH_CONTROL_PERSIST, SSH_WAIT_TIMEOUT, WATCH_INTERVAL
+
+
+SELECT_HELP = 'Select instances with a key=value expression (state, az, type, id, prip, pubip, ' \
+	'dns, pg; values may use wildcards) or index ranges such as 0-9. Repeat --select to combine ' \
+	'expressions. Indices always count within the whole context'
 
 NAME = 'instance manager'
 HELP = None
@@ -11,10 +17,15 @@ def add_arguments(parser):
 	general_parser = argparse.ArgumentParser(add_help=False)
 	general_parser.add_argument('--profile', type=str, default=None)
 	general_parser.add_argument('--region', '-r', type=str, default=None)
+	general_parser.add_argument('--refresh', action='store_true',
+								help='Bypass the local inventory cache')
 
 	from manec2.ec2.command import get_contexts_command
 	get_contexts_parser = subparsers.add_parser('contexts', help=None, parents=[general_parser])
-	get_contexts_parser.set_defaults(command=get_contexts_command)
+	get_contexts_parser.set_defaults(command=get_contexts_command, multi_region=True)
+	get_contexts_parser.add_argument('--profiles', type=str, nargs='+', default=None)
+	get_contexts_parser.add_argument('--format', type=str, choices=OUTPUT_FORMATS,
+									 default='text')
 
 	from manec2.ec2.command import create_instances_command
 	create_instance_parser = subparsers.add_parser('create', help=None, parents=[general_parser])
@@ -31,34 +42,57 @@ def add_arguments(parser):
 	create_instance_parser.add_argument('--pg', type=str, default=None)
 	create_instance_parser.add_argument('--spot', action='store_true')
 	create_instance_parser.add_argument('--key-pair', '-k', type=str, default=None)
+	create_instance_parser.add_argument('--azs', type=str, nargs='+', default=None,
+										help='Spread the launch over these availability zones')
+	create_instance_parser.add_argument('--fallback-types', type=str, nargs='+', default=None,
+										help='Instance types to use once --type runs out of capacity')
+	create_instance_parser.add_argument('--chunk-size', type=int, default=LAUNCH_CHUNK_SIZE)
 
 	create_instance_parser.add_argument('--incremental', '-inc', action='store_true',
 										default=False)
+	create_instance_parser.add_argument('--restart-stopped', action='store_true', default=False,
+										help='With --incremental, start stopped members before launching')
+	create_instance_parser.add_argument('--wait', '-w', action='store_true', default=False)
+	create_instance_parser.add_argument('--wait-timeout', type=int, default=LIFECYCLE_WAIT_TIMEOUT)
 
 	from manec2.ec2.command import terminate_instances_command
 	terminate_instance_parser = subparsers.add_parser('terminate', help=None, parents=[general_parser])
 	terminate_instance_parser.set_defaults(command=terminate_instances_command)
+	terminate_instance_parser.add_argument('--select', type=str, action='append', default=None,
+										help=SELECT_HELP)
 	terminate_instance_parser.add_argument('ctx', type=str, nargs='+', default=None)
 	terminate_instance_parser.add_argument('--indices', '-ids', type=int, nargs='+',
 										default=-1)
+	terminate_instance_parser.add_argument('--wait', '-w', action='store_true', default=False)
+	terminate_instance_parser.add_argument('--wait-timeout', type=int, default=LIFECYCLE_WAIT_TIMEOUT)
 
 	from manec2.ec2.command import start_instances_command
 	start_instance_parser = subparsers.add_parser('start', help=None, parents=[general_parser])
 	start_instance_parser.set_defaults(command=start_instances_command)
+	start_instance_parser.add_argument('--select', type=str, action='append', default=None,
+										help=SELECT_HELP)
 	start_instance_parser.add_argument('ctx', type=str, nargs='+', default=None)
 	start_instance_parser.add_argument('--indices', '-ids', type=int, nargs='+',
 									   default=-1)
+	start_instance_parser.add_argument('--wait', '-w', action='store_true', default=False)
+	start_instance_parser.add_argument('--wait-timeout', type=int, default=LIFECYCLE_WAIT_TIMEOUT)
 
 	from manec2.ec2.command import stop_instances_command
 	stop_instance_parser = subparsers.add_parser('stop', help=None, parents=[general_parser])
 	stop_instance_parser.set_defaults(command=stop_instances_command)
+	stop_instance_parser.add_argument('--select', type=str, action='append', default=None,
+										help=SELECT_HELP)
 	stop_instance_parser.add_argument('ctx', type=str, nargs='+', default=None)
 	stop_instance_parser.add_argument('--indices', '-ids', type=int, nargs='+',
 									  default=-1)
+	stop_instance_parser.add_argument('--wait', '-w', action='store_true', default=False)
+	stop_instance_parser.add_argument('--wait-timeout', type=int, default=LIFECYCLE_WAIT_TIMEOUT)
 
 	from manec2.ec2.command import reboot_instances_command
 	reboot_instance_parser = subparsers.add_parser('reboot', help=None, parents=[general_parser])
 	reboot_instance_parser.set_defaults(command=reboot_instances_command)
+	reboot_instance_parser.add_argument('--select', type=str, action='append', default=None,
+										help=SELECT_HELP)
 	reboot_instance_parser.add_argument('ctx', type=str, nargs='+', default=None)
 	reboot_instance_parser.add_argument('--indices', '-ids', type=int, nargs='+',
 										default=-1)
@@ -71,10 +105,14 @@ def add_arguments(parser):
 	image_instance_parser.add_argument('--image-name', '-n', type=str, default=None)
 	image_instance_parser.add_argument('--description', '-desc', type=str, default='')
 	image_instance_parser.add_argument('--wait', action='store_true', default=False)
+	image_instance_parser.add_argument('--wait-timeout', type=int, default=LIFECYCLE_WAIT_TIMEOUT)
 
 	from manec2.ec2.command import info_instances_command
 	info_instance_parser = subparsers.add_parser('info', help=None, parents=[general_parser])
-	info_instance_parser.set_defaults(command=info_instances_command)
+	info_instance_parser.set_defaults(command=info_instances_command, multi_region=True)
+	info_instance_parser.add_argument('--select', type=str, action='append', default=None,
+										help=SELECT_HELP)
+	info_instance_parser.add_argument('--profiles', type=str, nargs='+', default=None)
 	info_instance_parser.add_argument('ctx', type=str, nargs='+', default=None)
 	info_instance_parser.add_argument('--indices', '-ids', type=int, nargs='+',
 									  default=-1)
@@ -85,10 +123,17 @@ def add_arguments(parser):
 	info_instance_parser.add_argument('--zone', action='store_true')
 	info_instance_parser.add_argument('--state', action='store_true')
 	info_instance_parser.add_argument('--text', action='store_true')
+	info_instance_parser.add_argument('--format', type=str, choices=OUTPUT_FORMATS,
+									  default='text')
+	info_instance_parser.add_argument('--watch', type=float, nargs='?', const=WATCH_INTERVAL,
+									  default=None, metavar='INTERVAL',
+									  help='Keep the table up to date, refreshing every INTERVAL seconds')
 
 	from manec2.ec2.command import ssh_instance_command
 	ssh_instance_parser = subparsers.add_parser('ssh', help=None, parents=[general_parser])
 	ssh_instance_parser.set_defaults(command=ssh_instance_command)
+	ssh_instance_parser.add_argument('--select', type=str, action='append', default=None,
+										help=SELECT_HELP)
 	ssh_instance_parser.add_argument('ctx', type=str, default=None)
 	ssh_instance_parser.add_argument('--indices', '-ids', type=int, nargs='+',
 									 default=[0])
@@ -99,12 +144,20 @@ def add_arguments(parser):
 	ssh_instance_parser.add_argument('--comm', '-c', type=str, default='')
 
 	ssh_instance_parser.add_argument('--parallel', '-p', action='store_true')
+	ssh_instance_parser.add_argument('--max-parallel', '-mp', type=int,
+									default=DEFAULT_MAX_PARALLEL)
+	ssh_instance_parser.add_argument('--no-mux', action='store_true',
+									help='Do not share SSH control masters')
+	ssh_instance_parser.add_argument('--output', type=str, choices=OUTPUT_MODES, default=None)
 	ssh_instance_parser.add_argument('--sudo', '-s', action='store_true')
 	ssh_instance_parser.add_argument('--wait', '-w', action='store_true')
+	ssh_instance_parser.add_argument('--wait-timeout', type=int, default=SSH_WAIT_TIMEOUT)
 
 	from manec2.ec2.command import rsync_instance_command
 	rsync_instance_parser = subparsers.add_parser('rsync', help=None, parents=[general_parser])
 	rsync_instance_parser.set_defaults(command=rsync_instance_command)
+	rsync_instance_parser.add_argument('--select', type=str, action='append', default=None,
+										help=SELECT_HELP)
 	rsync_instance_parser.add_argument('ctx', type=str, default='')
 	rsync_instance_parser.add_argument('--user', '-u', type=str, default=None)
 	rsync_instance_parser.add_argument('--key', '-i', type=str, default=None)
@@ -115,11 +168,22 @@ def add_arguments(parser):
 	rsync_instance_parser.add_argument('--indices', '-ids', type=int, nargs='+',
 									   default=-1)
 	rsync_instance_parser.add_argument('--parallel', '-p', action='store_true')
+	rsync_instance_parser.add_argument('--max-parallel', '-mp', type=int,
+									default=DEFAULT_MAX_PARALLEL)
+	rsync_instance_parser.add_argument('--no-mux', action='store_true',
+									help='Do not share SSH control masters')
+	rsync_instance_parser.add_argument('--output', type=str, choices=OUTPUT_MODES, default=None)
 	rsync_instance_parser.add_argument('--force', action='store_true')
+	rsync_instance_parser.add_argument('--relay', action='store_true',
+									   help='Push to seed instances that relay to their peers')
+	rsync_instance_parser.add_argument('--relay-seeds', type=int, default=1)
+	rsync_instance_parser.add_argument('--relay-fanout', type=int, default=2)
 
 	from manec2.ec2.command import scp_instance_command
 	scp_instance_parser = subparsers.add_parser('scp', help=None, parents=[general_parser])
 	scp_instance_parser.set_defaults(command=scp_instance_command)
+	scp_instance_parser.add_argument('--select', type=str, action='append', default=None,
+										help=SELECT_HELP)
 	scp_instance_parser.add_argument('ctx', type=str, default='')
 	scp_instance_parser.add_argument('file', type=str, default=None)
 	scp_instance_parser.add_argument('--user', '-u', type=str, default=None)
@@ -127,10 +191,37 @@ def add_arguments(parser):
 	scp_instance_parser.add_argument('--get', action='store_true', default=False)
 	scp_instance_parser.add_argument('--put', action='store_true', default=False)
 	scp_instance_parser.add_argument('--recursive', action='store_true', default=False)
+	scp_instance_parser.add_argument('--skip-identical', action='store_true', default=False,
+									 help='With --put, only send to hosts whose copy differs')
+	scp_instance_parser.add_argument('--tar', action='store_true', default=False,
+									 help='Stream files as a tar archive over one ssh channel')
+	scp_instance_parser.add_argument('--compress', '-z', action='store_true', default=False)
+	scp_instance_parser.add_argument('--host-dirs', type=str, choices=['index', 'id'], default=None,
+									 help='With --get, put each host\'s files in its own subdirectory')
 	scp_instance_parser.add_argument('--location', '-l', type=str, default='.')
 	scp_instance_parser.add_argument('--indices', '-ids', type=int, nargs='+',
 									 default=-1)
 	scp_instance_parser.add_argument('--parallel', '-p', action='store_true')
+	scp_instance_parser.add_argument('--max-parallel', '-mp', type=int,
+									default=DEFAULT_MAX_PARALLEL)
+	scp_instance_parser.add_argument('--no-mux', action='store_true',
+									help='Do not share SSH control masters')
+	scp_instance_parser.add_argument('--output', type=str, choices=OUTPUT_MODES, default=None)
+
+	from manec2.ec2.command import mux_instance_command
+	mux_instance_parser = subparsers.add_parser('mux', help=None, parents=[general_parser])
+	mux_instance_parser.set_defaults(command=mux_instance_command)
+	mux_instance_parser.add_argument('--select', type=str, action='append', default=None,
+										help=SELECT_HELP)
+	mux_instance_parser.add_argument('action', type=str, choices=['open', 'list', 'close'])
+	mux_instance_parser.add_argument('ctx', type=str, default='')
+	mux_instance_parser.add_argument('--user', '-u', type=str, default=None)
+	mux_instance_parser.add_argument('--key', '-i', type=str, default=None)
+	mux_instance_parser.add_argument('--indices', '-ids', type=int, nargs='+',
+									 default=-1)
+	mux_instance_parser.add_argument('--persist', type=str, default=SSH_CONTROL_PERSIST)
+	mux_instance_parser.add_argument('--max-parallel', '-mp', type=int,
+									default=DEFAULT_MAX_PARALLEL)
 
 
 ## Commands that interact with AWS infrastructure
@@ -179,3 +270,7 @@ def rsync_instance_command(options):
 def scp_instance_command(options):
 	from .instance import scp_instance
 	scp_instance(options)
+
+def mux_instance_command(options):
+	from .instance import manage_ssh_masters
+	manage_ssh_masters(options)
@@ -1,75 +1,206 @@
-import boto3
-import json
+import fnmatch
 import os
+import shlex
 import time
-import subprocess
 import sys
-import yaml
 
 
 import manec2
-from manec2.utils.instance_type import Instance
-from manec2.utils.load_defaults import get_default_config
+from manec2.utils.aws_session import get_client, get_resource
+from manec2.utils.batch import mutate_instances
+from manec2.utils.digest import file_digest, format_bytes, parse_digest, \
+	quote_remote_path, remote_digest_command
+from manec2.utils.instance_type import parse_instance
+from manec2.utils.launcher import sharded_launch
+from manec2.utils.inventory_cache import cache_instances, get_cached_instances, \
+	invalidate_instances
+from manec2.utils.load_defaults import get_default_config, get_ssh_options
 from manec2.utils.constants import RED_TEXT, RESET_TEXT
+from manec2.utils.fanout import fan_out, is_multi_target
+from manec2.utils.executor import output_mode, report_results, run_on_hosts
+from manec2.utils.readiness import wait_for_ssh
+from manec2.utils.relay import relay_distribute
+from manec2.utils.waiter import describe_instance_ids, wait_for_image, wait_for_instances
+from manec2.utils.watch import watch_instances
+from manec2.utils.records import INSTANCE_FIELDS, TARGET_FIELDS, RecordWriter, instance_record
+from manec2.utils.selector import LIVE_STATES, parse_selector, pushdown_filters, select_instances
+from manec2.utils.ssh_mux import ssh_mux_commands, ssh_mux_options
+from manec2.utils.trace import record_span
 
 def create_boto3_client(profile, region, service='ec2'):
-	session = boto3.Session(profile_name=profile)
-	return session.client(service, region_name=region)
+	return get_client(profile, region, service)
+
+def _get_name_tag(inst):
+	for pair in inst.get('Tags', []):
+		if pair['Key'] == 'Name':
+			return pair['Value']
+
+	return None
+
+def iter_instance_info(ctxs, options, use_cache=True, filters=None):
+	"""
+	Yield (ctx, instances) batches for every context in ctxs as they become
+	available: contexts with a fresh entry in the local inventory cache first,
+	then one batch per describe_instances page, in API order. The queried
+	contexts are cached once the last page has arrived, unless --refresh is
+	given the cache is also read.
+
+	filters are extra describe_instances Filters pushed down to EC2. Filtered
+	results are partial contexts and are not cached. Cached contexts are still
+	served in full, the caller filters them like any other result.
+	"""
+	ctxs = list(dict.fromkeys(ctxs))
+	use_cache = use_cache and not getattr(options, 'refresh', False)
+	filters = filters or []
+
+	cached = get_cached_instances(options.profile, options.region, ctxs) if use_cache else {}
+	for ctx in ctxs:
+		if ctx in cached:
+			yield ctx, cached[ctx]
+
+	ctx_instances = { ctx: [] for ctx in ctxs if ctx not in cached }
+	if not ctx_instances:
+		return
 
-def query_ctx_instance_info(ctx, options):
-	ec2_cli = create_boto3_client(options.profile, options.region)
+	queried_ctxs = list(ctx_instances)
 
-	response = ec2_cli.describe_instances(
+	ec2_cli = create_boto3_client(options.profile, options.region)
+	paginator = ec2_cli.get_paginator('describe_instances')
+	state_filters = [f for f in filters if f['Name'] == 'instance-state-name']
+	if not state_filters:
+		state_filters = [{ "Name": 'instance-state-name', "Values": LIVE_STATES }]
+	pages = paginator.paginate(
 		Filters=[
 			{
 				"Name": 'tag:Name',
-				"Values": [ctx]
-			},
-			{
-				"Name": 'instance-state-name',
-				"Values": ['stopped', 'stopping', 'pending', 'running']
+				"Values": queried_ctxs
 			}
-		]
+		] + _merge_state_filters(state_filters) \
+			+ [f for f in filters if f['Name'] != 'instance-state-name']
 	)
 
-	instances = []
-	for res in response['Reservations']:
-		for inst in res['Instances']:
-			inst_id = inst['InstanceId']
-			inst_type = inst['InstanceType']
-			inst_place = inst['Placement']['AvailabilityZone']
-			state = inst['State']['Name']
-			prip = '0'
-			pubip = '0'
-			dns = '0'
-			prip = inst['PrivateIpAddress']
-			if state ==  'running':
-				pubip = inst['PublicIpAddress']
-				dns = inst['PublicDnsName']
-			instances.append(Instance(inst_id, inst_type, inst_place, prip, pubip,
-				dns, state))
-
-	instances.sort(key=lambda x : x.id)
-	return instances
-
-def get_contexts(options):
+	query_start = time.perf_counter()
+	page_count = 0
+	for page in pages:
+		page_count += 1
+		page_instances = { ctx: [] for ctx in queried_ctxs }
+		for res in page['Reservations']:
+			for inst in res['Instances']:
+				name = _get_name_tag(inst)
+				if name is None:
+					continue
+
+				## Contexts may contain EC2 filter wildcards
+				matched = [ctx for ctx in queried_ctxs if fnmatch.fnmatchcase(name, ctx)]
+				if not matched:
+					continue
+
+				instance = parse_instance(inst)
+				for ctx in matched:
+					page_instances[ctx].append(instance)
+
+		for ctx, instances in page_instances.items():
+			if instances:
+				ctx_instances[ctx] += instances
+				yield ctx, instances
+
+	record_span('query instances', 'phase', query_start, region=options.region,
+		contexts=queried_ctxs, pages=page_count,
+		instances=sum(len(instances) for instances in ctx_instances.values()))
+
+	if not filters:
+		for instances in ctx_instances.values():
+			instances.sort(key=lambda x : x.id)
+		cache_instances(options.profile, options.region, ctx_instances)
+
+def query_instance_info(ctxs, options, use_cache=True, filters=None):
+	"""
+	Resolve the live instances of every context in ctxs with a single paginated
+	describe_instances call, see iter_instance_info. Returns a dict mapping each
+	context to its list of instances, sorted by ID.
+	"""
+	ctx_instances = { ctx: [] for ctx in ctxs }
+	for ctx, instances in iter_instance_info(ctxs, options, use_cache, filters):
+		ctx_instances[ctx] += instances
+
+	for instances in ctx_instances.values():
+		instances.sort(key=lambda x : x.id)
+
+	return ctx_instances
+
+def _merge_state_filters(state_filters):
+	## Repeated filter names are not allowed, intersect them into one
+	states = set(LIVE_STATES)
+	for state_filter in state_filters:
+		states &= set(state_filter['Values'])
+
+	return [{ "Name": 'instance-state-name', "Values": sorted(states) or ['none'] }]
+
+def query_ctx_instance_info(ctx, options, use_cache=True, filters=None):
+	return query_instance_info([ctx], options, use_cache, filters)[ctx]
+
+def iter_contexts(options):
+	"""
+	Yield the name of every context with live instances once, as the
+	describe_instances page that first mentions it arrives.
+	"""
 	ec2_cli = create_boto3_client(options.profile, options.region)
-	response = ec2_cli.describe_instances(
+	paginator = ec2_cli.get_paginator('describe_instances')
+	pages = paginator.paginate(
 		Filters=[
 			{
 				"Name": 'instance-state-name',
-				"Values": ['stopped', 'stopping', 'pending', 'running']
+				"Values": LIVE_STATES
 			}
 		]
 	)
 
 	contexts = set()
-	for res in response['Reservations']:
-		for inst in res['Instances']:
-			if 'Tags' in inst:
-				for pair in inst['Tags']:
-					if pair['Key'] == 'Name':
-						contexts.add(pair['Value'])
+	for page in pages:
+		for res in page['Reservations']:
+			for inst in res['Instances']:
+				name = _get_name_tag(inst)
+				if name is not None and name not in contexts:
+					contexts.add(name)
+					yield name
+
+def query_contexts(options):
+	return set(iter_contexts(options))
+
+def _write_context_records(options):
+	fields = ['context'] + (TARGET_FIELDS if is_multi_target(options) else [])
+	writer = RecordWriter(options.format, fields)
+	if is_multi_target(options):
+		for profile, region, contexts in fan_out(options, query_contexts):
+			profile = profile if profile is not None else 'default'
+			for ctx in sorted(contexts):
+				writer.write({ 'context': ctx, 'region': region, 'profile': profile })
+	elif options.format == 'ndjson':
+		for ctx in iter_contexts(options):
+			writer.write({ 'context': ctx })
+	else:
+		for ctx in sorted(query_contexts(options)):
+			writer.write({ 'context': ctx })
+
+	writer.close()
+
+def get_contexts(options):
+	if options.format != 'text':
+		_write_context_records(options)
+		return
+
+	if is_multi_target(options):
+		tagged_contexts = []
+		for profile, region, contexts in fan_out(options, query_contexts):
+			profile = profile if profile is not None else 'default'
+			tagged_contexts += [(ctx, region, profile) for ctx in sorted(contexts)]
+
+		print('Contexts:')
+		for i, (ctx, region, profile) in enumerate(tagged_contexts):
+			print(f'  {i:2d}  {ctx}  {region}  {profile}')
+		return
+
+	contexts = query_contexts(options)
 
 	print('Contexts:')
 	for i, ctx in enumerate(contexts):
@@ -81,10 +212,10 @@ def create_instances(options):
 		exit(17)
 
 	# Can't use boto3.client here. Use boto3.resource
-	session = boto3.Session(profile_name=options.profile)
-	ec2 = boto3.resource('ec2', region_name=options.region)
+	ec2 = get_resource(options.profile, options.region)
 
 	if options.file:
+		import yaml
 		launch_params = yaml.safe_load(open(options.file, 'r'))
 		print(f'Launching with args {launch_params}')
 
@@ -92,8 +223,25 @@ def create_instances(options):
 		instance_ids = [inst.id for inst in response]
 		print("Created instances", instance_ids)
 
+		## The launch file decides the Name tag, drop every context in the region
+		invalidate_instances(options.profile, options.region)
+
+		if options.wait:
+			wait_for_instances(create_boto3_client(options.profile, options.region),
+				instance_ids, 'running', options.wait_timeout)
+
 		return
 
+	launch_count = options.cnt
+	restarted_ids = []
+	if options.incremental:
+		launch_count, restarted_ids = _top_up_context(options)
+		if launch_count == 0:
+			if options.wait and restarted_ids:
+				wait_for_instances(create_boto3_client(options.profile, options.region),
+					restarted_ids, 'running', options.wait_timeout)
+			return
+
 	default_config = get_default_config(options)
 
 	if options.ami == None:
@@ -103,8 +251,8 @@ def create_instances(options):
 	args = {
 		'ImageId': options.ami,
 		'InstanceType': options.type,
-		'MinCount': options.cnt,
-		'MaxCount': options.cnt,
+		'MinCount': launch_count,
+		'MaxCount': launch_count,
 		'KeyName': default_config['InstanceOptions']['KeyPair'][options.region] if options.key_pair == None else options.key_pair,
 		'TagSpecifications': [
 			{
@@ -144,64 +292,135 @@ def create_instances(options):
 
 	print(f'Launching with args {args}')
 
-	response = ec2.create_instances(**args)
-	instance_ids = [inst.id for inst in response]
+	sharded = launch_count > options.chunk_size or options.azs or options.fallback_types
+	if sharded:
+		azs = options.azs if options.azs else [options.az]
+		instance_ids = sharded_launch(create_boto3_client(options.profile, options.region),
+			args, launch_count, azs, [options.type] + (options.fallback_types or []),
+			options.chunk_size)
+	else:
+		response = ec2.create_instances(**args)
+		instance_ids = [inst.id for inst in response]
 	print("Created instances", instance_ids)
 
-def terminate_instances(options):
-	ec2_cli = create_boto3_client(options.profile, options.region)
+	invalidate_instances(options.profile, options.region, [options.ctx], instance_ids)
+
+	if options.wait and restarted_ids + instance_ids:
+		wait_for_instances(create_boto3_client(options.profile, options.region),
+			restarted_ids + instance_ids, 'running', options.wait_timeout)
+
+	if len(instance_ids) < launch_count:
+		exit(16)
+
+def _top_up_context(options):
+	"""
+	Compare the live size of options.ctx with --cnt. With --restart-stopped,
+	stopped members are started first to cover the shortfall. Returns the
+	number of instances still to launch and the IDs that were started.
+	"""
+	current_instances = query_ctx_instance_info(options.ctx, options, use_cache=False)
+	live = [inst for inst in current_instances if inst.last_observed_state in ('pending', 'running')]
+	stopped = [inst for inst in current_instances if inst.last_observed_state == 'stopped']
+
+	shortfall = options.cnt - len(live)
+	if shortfall <= 0:
+		print(f"Context '{options.ctx}' already has {len(live)} live instances, nothing to launch")
+		return 0, []
+
+	restarted_ids = []
+	if options.restart_stopped and stopped:
+		restarted_ids = [inst.id for inst in stopped[:shortfall]]
+		ec2_cli = create_boto3_client(options.profile, options.region)
+		ec2_cli.start_instances(InstanceIds=restarted_ids)
+		print(f"Starting '{options.ctx}' instances", ", ".join(restarted_ids))
+		invalidate_instances(options.profile, options.region, [options.ctx], restarted_ids)
+		shortfall -= len(restarted_ids)
+
+	print(f"Context '{options.ctx}' has {len(live) + len(restarted_ids)} live instances, "
+		f"launching {shortfall} to reach {options.cnt}")
+	return shortfall, restarted_ids
+
+def _selected_ids(options):
+	"""
+	Resolve the selection of every context in options.ctx. Returns a dict
+	mapping each instance ID to the context it was selected from, with IDs
+	selected from several contexts listed once.
+	"""
+	ctx_instances = query_instance_info(options.ctx, options, use_cache=False,
+		filters=pushdown_filters(options, options.indices))
+	id_ctxs = {}
 	for ctx in options.ctx:
-		current_instances = query_ctx_instance_info(ctx, options)
+		selected = select_instances(ctx_instances[ctx], options, options.indices)
+		if not selected:
+			print(f"No instances in context '{ctx}' match the selection")
+			continue
 
-		msg = f"Are you sure you want to " + RED_TEXT + "terminate " + \
-			f"{'**ALL** instances' if options.indices == -1 else f'instances {options.indices}'} " \
-			+ RESET_TEXT + f"in context '{ctx}'?\nType '" + RED_TEXT + "terminate" + RESET_TEXT + "' to confirm\n"
-		confirm = input(msg)
+		for _, inst in selected:
+			id_ctxs.setdefault(inst.id, ctx)
 
-		if confirm != 'terminate':
-			return
+	return id_ctxs
 
-		instance_ids = [inst.id for inst in current_instances] if options.indices == -1 \
-			else [current_instances[i].id for i in options.indices]
-		if options.indices != -1:
-			ec2_cli.terminate_instances(InstanceIds=instance_ids)
-			print("Terminating instances", ", ".join([str(id) for id in instance_ids]))
-		else:
-			ec2_cli.terminate_instances(InstanceIds=instance_ids)
-			print("Terminating instances", ", ".join([str(id) for id in instance_ids]))
+def _confirm_terminate(options, id_ctxs):
+	if options.select:
+		target = f'{len(id_ctxs)} selected instances'
+	else:
+		target = '**ALL** instances' if options.indices == -1 else f'instances {options.indices}'
+
+	ctxs = list(dict.fromkeys(id_ctxs.values()))
+	where = f"context '{ctxs[0]}'" if len(ctxs) == 1 \
+		else 'contexts ' + ', '.join(f"'{ctx}'" for ctx in ctxs)
+
+	msg = f"Are you sure you want to " + RED_TEXT + "terminate " + \
+		f"{target} " \
+		+ RESET_TEXT + f"in {where}?\nType '" + RED_TEXT + "terminate" + RESET_TEXT + "' to confirm\n"
+	return input(msg) == 'terminate'
+
+def _mutate_selection(options, action, verb, target_state=None):
+	"""
+	Apply a lifecycle action to the selected instances of every context at
+	once, see mutate_instances. Prints the instances the action was applied to
+	per context and the reason each failed instance was rejected, then waits
+	for target_state with --wait. Exits if any instance failed.
+	"""
+	id_ctxs = _selected_ids(options)
+	if not id_ctxs:
+		return
+
+	if action == 'terminate' and not _confirm_terminate(options, id_ctxs):
+		return
 
-def start_instances(options):
 	ec2_cli = create_boto3_client(options.profile, options.region)
-	for ctx in options.ctx:
-		current_instances = query_ctx_instance_info(ctx, options)
-		instance_ids = [inst.id for inst in current_instances]
-		if options.indices != -1:
-			instance_ids = [instance_ids[i] for i in options.indices]
+	result = mutate_instances(ec2_cli, action, list(id_ctxs))
+	invalidate_instances(options.profile, options.region, list(dict.fromkeys(id_ctxs.values())),
+		list(id_ctxs))
 
-		ec2_cli.start_instances(InstanceIds=instance_ids)
-		print(f"Starting '{ctx}' instances", ", ".join([str(id) for id in instance_ids]))
+	for ctx in dict.fromkeys(id_ctxs.values()):
+		instance_ids = [id for id, id_ctx in id_ctxs.items() if id_ctx == ctx and id in result.succeeded]
+		if instance_ids:
+			print(f"{verb} '{ctx}' instances", ", ".join(instance_ids))
 
-def stop_instances(options):
-	ec2_cli = create_boto3_client(options.profile, options.region)
-	for ctx in options.ctx:
-		current_instances = query_ctx_instance_info(ctx, options)
-		instance_ids = [inst.id for inst in current_instances]
-		if options.indices != -1:
-			instance_ids = [instance_ids[i] for i in options.indices]
+	if result.failed:
+		print(RED_TEXT + f"{len(result.failed)} of {len(id_ctxs)} instances failed:" + RESET_TEXT)
+		for id, (code, message) in sorted(result.failed.items()):
+			print(f"  {id}  {id_ctxs[id]}  {code}: {message}")
 
-		ec2_cli.stop_instances(InstanceIds=instance_ids)
-		print(f"Stopping '{ctx}' instances", ", ".join([str(id) for id in instance_ids]))
+	if target_state is not None and options.wait and result.succeeded:
+		wait_for_instances(ec2_cli, list(result.succeeded), target_state, options.wait_timeout)
 
-def reboot_instances(options):
-	ec2_cli = create_boto3_client(options.profile, options.region)
-	for ctx in options.ctx:
-		current_instances = query_ctx_instance_info(ctx, options)
-		instance_ids = [inst.id for inst in current_instances]
-		if options.indices!= -1:
-			instance_ids = [instance_ids[i] for i in options.indices]
+	if result.failed:
+		exit(18)
 
-		ec2_cli.reboot_instances(InstanceIds=instance_ids)
-		print(f"Rebooting '{ctx}' instances", ", ".join([str(id) for id in instance_ids]))
+def terminate_instances(options):
+	_mutate_selection(options, 'terminate', 'Terminating', 'terminated')
+
+def start_instances(options):
+	_mutate_selection(options, 'start', 'Starting', 'running')
+
+def stop_instances(options):
+	_mutate_selection(options, 'stop', 'Stopping', 'stopped')
+
+def reboot_instances(options):
+	_mutate_selection(options, 'reboot', 'Rebooting')
 
 def create_instance_image(options):
 	current_instances = query_ctx_instance_info(options.ctx, options)
@@ -217,239 +436,459 @@ def create_instance_image(options):
 	image_id = crt_img_response['ImageId']
 
 	if options.wait:
-		while True:
-			desc_image_response = ec2_cli.describe_images(ImageIds=[image_id])
-			current_state = desc_image_response['Images'][0]['State']
-			if current_state == 'available':
-				break
-
-			if current_state != 'pending':
-				print(f'Image has status {current_state}. Ending...', file=sys.stderr)
-				sys.exit(13)
+		wait_for_image(ec2_cli, image_id, options.wait_timeout)
 
-			time.sleep(5)
-
-		print(f'Image {image_id} available for use')
-
-def print_full_info(indices, ctx, instance_info):
+def print_full_info(selected, ctx, instance_info):
 	print(str(len(instance_info)) + " instances:")
-	for i in indices:
-		inst = instance_info[i]
+	for i, inst in selected:
 		print("  {:2d}  {}  {}  {}  {:15}  {}".format(i, inst.id, inst.type,
 			inst.placement, inst.pr_ip, inst.last_observed_state))
 
-def get_instance_info(options):
+def _instance_field(inst, options):
+	"""
+	The field of inst selected by the info flags, or None for the full row.
+	"""
+	if options.pubip:
+		return inst.pub_ip
+	elif options.dns:
+		return inst.dns
+	elif options.prip:
+		return inst.pr_ip
+	elif options.type:
+		return inst.type
+	elif options.zone:
+		return inst.placement
+	elif options.state:
+		return inst.last_observed_state
+
+	return None
+
+def _get_multi_target_instance_info(options):
+	pair_results = fan_out(options, lambda pair_options: query_instance_info(options.ctx, pair_options))
+
 	for i, ctx in enumerate(options.ctx):
-		current_instances = query_ctx_instance_info(ctx, options)
-		if len(current_instances) == 0:
+		if i > 0:
+			print()
+
+		rows = []
+		for profile, region, ctx_instances in pair_results:
+			profile = profile if profile is not None else 'default'
+			rows += [(region, profile, inst) for inst in ctx_instances[ctx]]
+
+		if len(rows) == 0:
 			print(f"Context '{ctx}' has no live instances")
-			return
+			continue
 
 		if not options.text:
 			print("Context '" + ctx + "'")
-		indices = range(len(current_instances)) if options.indices == -1 else options.indices
-		for ind in indices:
-			inst = current_instances[ind]
-
-			msg = ''
-			if options.pubip:
-				msg = inst.pub_ip
-			elif options.dns:
-				msg = inst.dns
-			elif options.prip:
-				msg = inst.pr_ip
-			elif options.type:
-				msg = inst.type
-			elif options.zone:
-				msg = inst.placement
-			elif options.state:
-				msg = inst.last_observed_state
-			else:
-				print_full_info(indices, ctx, current_instances)
-				break
-
-			msg = msg if options.text else "  ".join(["", str(ind), msg])
+			if _instance_field(rows[0][2], options) is None:
+				print(str(len(rows)) + " instances:")
+
+		selected = select_instances([inst for _, _, inst in rows], options, options.indices)
+		for ind, _ in selected:
+			region, profile, inst = rows[ind]
+			msg = _instance_field(inst, options)
+			if msg is None:
+				print("  {:2d}  {}  {}  {}  {:15}  {:8}  {}  {}".format(ind, inst.id, inst.type,
+					inst.placement, inst.pr_ip, inst.last_observed_state, region, profile))
+				continue
+
+			msg = msg if options.text else "  ".join(["", str(ind), msg, region, profile])
 			print(msg)
 
-		if i < len(options.ctx) - 1:
-			print()
+def _write_instance_records(options):
+	"""
+	info in one of the structured output formats. Without positional selection
+	ndjson records are streamed page by page, in API order and with a null
+	index, the --select terms are pushed down to EC2. Every other case
+	resolves the full contexts first and numbers the records like the text
+	output.
+	"""
+	filters = pushdown_filters(options, options.indices)
+	if is_multi_target(options):
+		writer = RecordWriter(options.format, INSTANCE_FIELDS + TARGET_FIELDS)
+		pair_results = fan_out(options, lambda pair_options: query_instance_info(options.ctx, pair_options))
+		for ctx in options.ctx:
+			rows = []
+			for profile, region, ctx_instances in pair_results:
+				profile = profile if profile is not None else 'default'
+				rows += [(region, profile, inst) for inst in ctx_instances[ctx]]
+
+			selected = select_instances([inst for _, _, inst in rows], options, options.indices)
+			for ind, _ in selected:
+				region, profile, inst = rows[ind]
+				writer.write(instance_record(ctx, ind, inst, region, profile))
+	elif options.format == 'ndjson' and filters is not None:
+		writer = RecordWriter(options.format, INSTANCE_FIELDS)
+		selector = parse_selector(options)
+		for ctx, instances in iter_instance_info(options.ctx, options, filters=filters):
+			for inst in instances:
+				if selector is None or selector.matches(None, inst):
+					writer.write(instance_record(ctx, None, inst))
+	else:
+		writer = RecordWriter(options.format, INSTANCE_FIELDS)
+		ctx_instances = query_instance_info(options.ctx, options)
+		for ctx in options.ctx:
+			for ind, inst in select_instances(ctx_instances[ctx], options, options.indices):
+				writer.write(instance_record(ctx, ind, inst))
+
+	writer.close()
+
+def _watch_instance_info(options):
+	"""
+	info --watch: a full query of the contexts every WATCH_RECONCILE_INTERVAL
+	seconds, in between only the instances in transition are described.
+	"""
+	if options.format != 'text' or is_multi_target(options):
+		print('--watch only works with the text output of a single profile and region')
+		exit(13)
+	if options.watch <= 0:
+		print('--watch interval must be positive')
+		exit(13)
 
-def _ssh_failure(inst, trials):
-	time.sleep(3)
+	ec2_cli = create_boto3_client(options.profile, options.region)
 
-	if trials > 20:
-		print(f'Tried to access instances {inst.id} SSH 20 times. Failing...')
-		exit(15)
+	def full_refresh():
+		ctx_instances = query_instance_info(options.ctx, options, use_cache=False)
+		return { ctx: select_instances(ctx_instances[ctx], options, options.indices)
+			for ctx in options.ctx }
 
-	if trials % 3 == 0:
-		print(f'Connection timed out. Retrying...')
+	watch_instances(full_refresh, lambda instance_ids: [parse_instance(inst)
+		for inst in describe_instance_ids(ec2_cli, instance_ids)], options.watch)
 
-def _get_ssh_options(options):
-	default_config = get_default_config(options)
+def get_instance_info(options):
+	if options.watch is not None:
+		_watch_instance_info(options)
+		return
 
-	ssh_user = options.user if options.user is not None else default_config['SSHOptions'].get('User', None)
-	if ssh_user is None:
-		print("No default user found. Please provide a user (--user)")
-		exit(13)
+	if options.format != 'text':
+		_write_instance_records(options)
+		return
 
-	ssh_key = options.key if options.key is not None else default_config['SSHOptions']['Keys'].get(options.region, None)
-	if ssh_key is None:
-		print("No default key found. Please provide an SSH key (--key)")
-		exit(13)
+	if is_multi_target(options):
+		_get_multi_target_instance_info(options)
+		return
+
+	ctx_instances = query_instance_info(options.ctx, options)
+	for i, ctx in enumerate(options.ctx):
+		if i > 0:
+			print()
 
-	return ssh_user, ssh_key
+		current_instances = ctx_instances[ctx]
+		if len(current_instances) == 0:
+			print(f"Context '{ctx}' has no live instances")
+			continue
+
+		if not options.text:
+			print("Context '" + ctx + "'")
+		selected = select_instances(current_instances, options, options.indices)
+		if _instance_field(current_instances[0], options) is None:
+			print_full_info(selected, ctx, current_instances)
+		else:
+			for ind, inst in selected:
+				msg = _instance_field(inst, options)
+				msg = msg if options.text else "  ".join(["", str(ind), msg])
+				print(msg)
+
+def _running_filters(options, indices=-1):
+	"""
+	describe_instances Filters for commands that only use running hosts, so EC2
+	leaves out the rest of the context. Not for hosts addressed by position
+	(--indices or index ranges), which count in the full context. --select
+	terms are still matched locally.
+	"""
+	if pushdown_filters(options, indices) is None:
+		return None
+
+	return [{ "Name": 'instance-state-name', "Values": ['running'] }]
 
 def ssh_to_instance(options):
-	current_instances = query_ctx_instance_info(options.ctx, options)
+	filters = _running_filters(options) if options.all or options.select else None
+	current_instances = query_ctx_instance_info(options.ctx, options, filters=filters)
 
-	if options.all:
+	if options.all or options.select:
 		## Filter for instances that are currently running
-		current_instances = [inst for inst in current_instances if inst.last_observed_state == 'running']
-		if len(current_instances) == 0:
+		selected = [(i, inst) for i, inst in select_instances(current_instances, options) \
+					if inst.last_observed_state == 'running']
+		if len(selected) == 0:
 			print(f'No running instances in context {options.ctx}')
 			exit(13)
 	else:
-		current_instances = [current_instances[i] for i in options.indices]
-		for inst in current_instances:
+		selected = select_instances(current_instances, options, options.indices)
+		for _, inst in selected:
 			if inst.pub_ip == '0':
 				print("At least one public IP is '0'. Make sure instance is running")
 				exit(13)
 
-	ssh_user, ssh_key = _get_ssh_options(options)
+	ssh_user, ssh_key = get_ssh_options(options)
 
 	remote_access_opts = []
 	if ssh_key != '':
 		remote_access_opts = ['-i', ssh_key]
 		remote_access_opts = remote_access_opts + ['-t'] if options.sudo else remote_access_opts
+	remote_access_opts = remote_access_opts + ssh_mux_options(options)
 
-	processes = []
-	for inst in current_instances:
+	host_probes = []
+	host_commands = []
+	for i, inst in selected:
 		ssh_command_base = ['ssh'] + remote_access_opts \
 			+ [ssh_user + '@' + inst.dns] \
 
-		ssh_command_test = ssh_command_base \
-			+ ['exit']
-
 		ssh_command_final = ssh_command_base \
 			+ options.comm.split()
 
-		if options.wait:
-			trials = 0
-			while True:
-				try:
-					retcode = subprocess.run(ssh_command_test, timeout=5).returncode
-					if retcode != 0:
-						_ssh_failure(inst, trials)
-					else:
-						break
-				except subprocess.TimeoutExpired:
-					_ssh_failure(inst, trials)
-
-				trials +=1
-
-		if options.parallel:
-			processes.append(subprocess.Popen(ssh_command_final))
-		else:
-			subprocess.run(ssh_command_final)
+		host_probes.append((i, inst.dns, ssh_command_base))
+		host_commands.append((i, inst.dns, [ssh_command_final]))
+
+	if options.wait:
+		wait_for_ssh(host_probes, options.wait_timeout, options.max_parallel)
 
-	if options.parallel:
-		for proc in processes:
-			proc.wait()
+	results = run_on_hosts(host_commands, options.parallel, options.max_parallel,
+		output_mode(options, len(host_commands)))
+	report_results(results, options.parallel)
 
-def rsync_instance(options):
-	current_instances = query_ctx_instance_info(options.ctx, options)
+def _select_running_instances(options):
+	filters = _running_filters(options, options.indices)
+	current_instances = query_ctx_instance_info(options.ctx, options, filters=filters)
 	if options.indices == -1:
-		current_instances = [inst for inst in current_instances \
-							if inst.last_observed_state == 'running']
-		if len(current_instances) == 0:
+		selected = [(i, inst) for i, inst in select_instances(current_instances, options) \
+					if inst.last_observed_state == 'running']
+		if len(selected) == 0:
 			print(f'No running instances in context {options.ctx}')
 			exit(13)
 	else:
-		current_instances = [current_instances[i] for i in options.indices]
+		selected = select_instances(current_instances, options, options.indices)
 
-	for inst in current_instances:
+	for _, inst in selected:
 		if inst.pub_ip == '0':
 			print("At least one public IP is '0'. Make sure instance is running")
 			exit(13)
 
-	ssh_user, ssh_key = _get_ssh_options(options)
+	return selected
 
-	remote_access_opts = []
+def rsync_instance(options):
+	selected = _select_running_instances(options)
+
+	ssh_user, ssh_key = get_ssh_options(options)
+
+	key_opts = []
 	if ssh_key != '':
-		remote_access_opts = ['-i', ssh_key]
+		key_opts = ['-i', ssh_key]
+	remote_access_opts = key_opts + ssh_mux_options(options)
 
-	confirmed = False
-	processes = []
-	for inst in current_instances:
-		if options.force:
-			delete_dir_command = 'rm -rf ' + options.location
-			create_dir_command = 'mkdir -p ' + options.location
-			ssh_command_base = ['ssh'] + remote_access_opts \
-				+ [ssh_user + '@' + inst.dns]
-			if not confirmed:
-				confirm = input("Are you sure you want to run 'rm -rf' on '"
-					+ options.location + "'? (yes/no)\n")
-				confirmed = confirm == 'yes'
-			if confirmed:
-				subprocess.run(ssh_command_base + delete_dir_command.split())
-				subprocess.run(ssh_command_base + create_dir_command.split())
-			else:
-				return
-
-		exclusions = ['--exclude'] + ' --exclude '.join(options.exclude).split() \
-			if len(options.exclude) != 0 else []
-		rsync_command = ['rsync', '-auzh', '-zz'] \
-			+ ['-e'] + [' '.join(["ssh"] + remote_access_opts)] \
-			+ exclusions + [options.file] \
-			+ [ssh_user + '@' + inst.dns+ ":" + options.location]
-
-		if options.parallel:
-			processes.append(subprocess.Popen(rsync_command))
-		else:
-			subprocess.run(rsync_command)
+	if options.force:
+		confirm = input("Are you sure you want to run 'rm -rf' on '"
+			+ options.location + "'? (yes/no)\n")
+		if confirm != 'yes':
+			return
+
+	exclusions = ['--exclude'] + ' --exclude '.join(options.exclude).split() \
+		if len(options.exclude) != 0 else []
+
+	if options.relay:
+		results = relay_distribute(selected,
+			lambda inst: _rsync_commands(inst, options, ssh_user, remote_access_opts, exclusions),
+			lambda src, dst: _rsync_relay_commands(src, dst, options, ssh_user,
+				remote_access_opts, key_opts, exclusions),
+			options.relay_seeds, options.relay_fanout, options.max_parallel,
+			options.output or 'prefix')
+		report_results(results, True)
+		return
 
-	if options.parallel:
-		for proc in processes:
-			proc.wait()
+	host_commands = []
+	for i, inst in selected:
+		commands = _rsync_commands(inst, options, ssh_user, remote_access_opts, exclusions)
+		host_commands.append((i, inst.dns, commands))
+
+	results = run_on_hosts(host_commands, options.parallel, options.max_parallel,
+		output_mode(options, len(host_commands)))
+	report_results(results, options.parallel)
+
+def _rsync_force_command(inst, options, ssh_user, remote_access_opts):
+	delete_dir_command = 'rm -rf ' + options.location
+	create_dir_command = 'mkdir -p ' + options.location
+	ssh_command_base = ['ssh'] + remote_access_opts \
+		+ [ssh_user + '@' + inst.dns]
+	return ssh_command_base + delete_dir_command.split() + ['&&'] \
+		+ create_dir_command.split()
+
+def _rsync_commands(inst, options, ssh_user, remote_access_opts, exclusions):
+	"""
+	Commands that push the payload from this machine to inst.
+	"""
+	commands = []
+	if options.force:
+		commands.append(_rsync_force_command(inst, options, ssh_user, remote_access_opts))
+
+	rsync_command = ['rsync', '-auzh', '-zz'] \
+		+ ['-e'] + [' '.join(["ssh"] + remote_access_opts)] \
+		+ exclusions + [options.file] \
+		+ [ssh_user + '@' + inst.dns+ ":" + options.location]
+	commands.append(rsync_command)
+
+	return commands
+
+def _relay_source(options):
+	"""
+	Where the payload ends up on a host after the direct rsync, written so that
+	relaying it to options.location on a peer gives the peer the same layout.
+	"""
+	if options.file.endswith('/'):
+		return options.location.rstrip('/') + '/'
+
+	return options.location.rstrip('/') + '/' + os.path.basename(options.file)
+
+def _rsync_relay_commands(src, dst, options, ssh_user, remote_access_opts, key_opts, exclusions):
+	"""
+	Commands that make src push the payload to dst over its private IP. The hop
+	authenticates with the operator's forwarded SSH agent, so the ssh to src
+	opens its own connection with key_opts: a shared control master only
+	forwards the agent if it was opened with forwarding.
+	"""
+	commands = []
+	if options.force:
+		commands.append(_rsync_force_command(dst, options, ssh_user, remote_access_opts))
+
+	hop_ssh = 'ssh -o BatchMode=yes -o StrictHostKeyChecking=accept-new'
+	hop_command = shlex.join(['rsync', '-auh', '-e', hop_ssh] + exclusions) \
+		+ ' ' + quote_remote_path(_relay_source(options)) \
+		+ ' ' + shlex.quote(ssh_user + '@' + dst.pr_ip + ':' + options.location)
+
+	## The source is a local path on src, its shell has to expand a leading ~/
+	commands.append(['ssh', '-A'] + key_opts + [ssh_user + '@' + src.dns] \
+		+ [hop_command])
+
+	return commands
 
 def scp_instance(options):
-	current_instances = query_ctx_instance_info(options.ctx, options)
-	if options.indices == -1:
-		current_instances = [inst for inst in current_instances \
-							if inst.last_observed_state == 'running']
-		if len(current_instances) == 0:
-			print(f'No running instances in context {options.ctx}')
-			exit(13)
-	else:
-		current_instances = [current_instances[i] for i in options.indices]
-
-	for inst in current_instances:
-		if inst.pub_ip == '0':
-			print("At least one public IP is '0'. Make sure instance is running")
-			exit(13)
+	selected = _select_running_instances(options)
 
-	ssh_user, ssh_key = _get_ssh_options(options)
+	ssh_user, ssh_key = get_ssh_options(options)
 
 	remote_access_opts = []
 	if ssh_key != '':
 		remote_access_opts = ['-i', ssh_key]
+	remote_access_opts = remote_access_opts + ssh_mux_options(options)
 
 	recursive_opts = []
 	if options.recursive:
 		recursive_opts = ['-r']
 
-	processes = []
-	for i, inst in enumerate(current_instances):
-		scp_cmd = ['scp'] + recursive_opts + remote_access_opts
-		if options.put:
-			scp_cmd = scp_cmd + [options.file, ssh_user + '@' + inst.dns + ':' + options.location]
-		elif options.get:
-			scp_cmd = scp_cmd + [ssh_user + '@' + inst.dns + ':' + options.file, options.location]
+	if options.skip_identical and options.put:
+		selected = _hosts_missing_file(selected, options, ssh_user, remote_access_opts)
+		if not selected:
+			return
 
-		if options.parallel:
-			processes.append(subprocess.Popen(scp_cmd))
+	## Gets from several hosts land in per-host directories so they never collide
+	host_dirs = options.host_dirs
+	if host_dirs is None and options.get and len(selected) > 1:
+		host_dirs = 'index'
+
+	host_commands = []
+	for i, inst in selected:
+		location = options.location
+		if options.get and host_dirs is not None:
+			location = os.path.join(options.location, str(i) if host_dirs == 'index' else inst.id)
+		## tar -C needs the directory to exist, scp needs it to write into it
+		if options.get and (host_dirs is not None or options.tar):
+			os.makedirs(location, exist_ok=True)
+
+		if options.tar:
+			scp_cmd = _tar_transfer_command(inst, options, ssh_user, remote_access_opts, location)
 		else:
-			subprocess.run(scp_cmd)
+			scp_cmd = ['scp'] + recursive_opts + remote_access_opts
+			if options.put:
+				scp_cmd = scp_cmd + [options.file, ssh_user + '@' + inst.dns + ':' + location]
+			elif options.get:
+				scp_cmd = scp_cmd + [ssh_user + '@' + inst.dns + ':' + options.file, location]
+
+		host_commands.append((i, inst.dns, [scp_cmd]))
+
+	results = run_on_hosts(host_commands, options.parallel, options.max_parallel,
+		output_mode(options, len(host_commands)))
+	report_results(results, options.parallel)
+
+def _tar_transfer_command(inst, options, ssh_user, remote_access_opts, location):
+	"""
+	Shell pipeline that streams options.file as a tar archive over a single ssh
+	channel, to location on inst with --put or from inst into the local location
+	with --get.
+	"""
+	tar_flags = '-czf' if options.compress else '-cf'
+	untar_flags = '-xzf' if options.compress else '-xf'
+	ssh_command = ['ssh'] + remote_access_opts + [ssh_user + '@' + inst.dns]
+	file = options.file.rstrip('/') or '/'
+
+	if options.put:
+		local_tar = ['tar', '-C', os.path.dirname(os.path.abspath(file)), tar_flags, '-',
+			os.path.basename(os.path.abspath(file))]
+		remote_untar = f'mkdir -p {quote_remote_path(location)} && ' \
+			+ f'tar -C {quote_remote_path(location)} {untar_flags} -'
+		pipeline = shlex.join(local_tar) + ' | ' + shlex.join(ssh_command + [remote_untar])
+	else:
+		remote_tar = f'tar -C {quote_remote_path(os.path.dirname(file) or ".")} {tar_flags} - ' \
+			+ shlex.quote(os.path.basename(file))
+		local_untar = ['tar', '-C', location, untar_flags, '-']
+		pipeline = shlex.join(ssh_command + [remote_tar]) + ' | ' + shlex.join(local_untar)
+
+	## Fail when either side of the pipe fails, not just the last one
+	return ['bash', '-o', 'pipefail', '-c', pipeline]
+
+def _hosts_missing_file(selected, options, ssh_user, remote_access_opts):
+	"""
+	Hash the local file once, compare it with the remote copy on every host
+	concurrently and return the hosts that are missing it or have a stale copy.
+	"""
+	if not os.path.isfile(options.file):
+		print(f"--skip-identical only works for regular files, sending '{options.file}' everywhere",
+			file=sys.stderr)
+		return selected
+
+	local_digest = file_digest(options.file)
+	check_command = remote_digest_command(options.file, options.location)
+
+	host_commands = []
+	for i, inst in selected:
+		ssh_command = ['ssh'] + remote_access_opts \
+			+ [ssh_user + '@' + inst.dns, check_command]
+		host_commands.append((i, inst.dns, [ssh_command]))
+
+	results = run_on_hosts(host_commands, True, options.max_parallel, 'capture')
+
+	missing = [(i, inst) for (i, inst), res in zip(selected, results) \
+			  if parse_digest(res.stdout) != local_digest]
+
+	skipped = len(selected) - len(missing)
+	saved = skipped * os.path.getsize(options.file)
+	print(f'{skipped}/{len(selected)} hosts already have an identical copy, '
+		f'saved {format_bytes(saved)}', file=sys.stderr)
+
+	return missing
+
+def manage_ssh_masters(options):
+	selected = _select_running_instances(options)
+
+	ssh_user, ssh_key = get_ssh_options(options)
+
+	remote_access_opts = []
+	if ssh_key != '':
+		remote_access_opts = ['-i', ssh_key]
+	remote_access_opts = remote_access_opts + ssh_mux_options(options, options.persist)
+
+	host_commands = []
+	for i, inst in selected:
+		ssh_command_base = ['ssh'] + remote_access_opts \
+			+ [ssh_user + '@' + inst.dns]
+		host_commands.append((i, inst.dns, [ssh_mux_commands(ssh_command_base, options.action)]))
+
+	output = 'quiet' if options.action == 'list' else 'prefix'
+	results = run_on_hosts(host_commands, True, options.max_parallel, output)
+
+	if options.action == 'list':
+		print("Context '" + options.ctx + "'")
+		for res in results:
+			print("  {:2d}  {}  {}".format(res.index, res.host,
+				'active' if res.succeeded else 'none'))
+		return
 
-	for proc in processes:
-		proc.wait()
\ No newline at end of file
+	report_results(results, True)
@@ -0,0 +1,91 @@
+import threading
+
+from manec2.utils.rate_limiter import get_bucket, limit_client, retry_config
+from manec2.utils.trace import span, trace_session
+
+## Every session, client and resource is built under its own lock, so threads
+## creating clients for different regions don't wait for each other
+_registry_lock = threading.Lock()
+_key_locks = {}
+_sessions = {}
+_clients = {}
+_resources = {}
+
+def _key_lock(key):
+    with _registry_lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+def get_session(profile):
+    """
+    Return the shared boto3 session for profile, creating it on first use.
+    """
+    session = _sessions.get(profile)
+    if session is not None:
+        return session
+
+    with _key_lock(('session', profile)):
+        session = _sessions.get(profile)
+        if session is None:
+            with span('boto3 session', profile=profile):
+                ## Importing boto3 loads botocore, only pay for it when AWS is needed
+                import boto3
+                session = boto3.Session(profile_name=profile)
+                ## Sessions set up their credential provider lazily and not thread
+                ## safe, do it once here before clients are created concurrently
+                session.get_credentials()
+            trace_session(session)
+            _sessions[profile] = session
+
+    return session
+
+def get_client(profile, region, service='ec2'):
+    """
+    Return the shared boto3 client for (profile, region, service). Clients are
+    thread safe and can be used from worker threads once created. Their calls
+    go through the endpoint's shared rate limiter and retry throttling.
+    """
+    key = (profile, region, service)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _key_lock(('client',) + key):
+        client = _clients.get(key)
+        if client is None:
+            session = get_session(profile)
+            with span(f'{service} client', region=region):
+                client = session.client(service, region_name=region, config=retry_config())
+            limit_client(client, get_bucket(profile, region, service))
+            _clients[key] = client
+
+    return client
+
+def get_resource(profile, region, service='ec2'):
+    """
+    Return the shared boto3 resource for (profile, region, service).
+    """
+    key = (profile, region, service)
+    resource = _resources.get(key)
+    if resource is not None:
+        return resource
+
+    with _key_lock(('resource',) + key):
+        resource = _resources.get(key)
+        if resource is None:
+            session = get_session(profile)
+            with span(f'{service} resource', region=region):
+                resource = session.resource(service, region_name=region, config=retry_config())
+            limit_client(resource.meta.client, get_bucket(profile, region, service))
+            _resources[key] = resource
+
+    return resource
+
+def reset_sessions():
+    """
+    Drop every shared session, client and resource, e.g. after the AWS
+    environment changed.
+    """
+    with _registry_lock:
+        _sessions.clear()
+        _clients.clear()
+        _resources.clear()
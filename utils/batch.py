@@ -0,0 +1,88 @@
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from manec2.utils.constants import MUTATION_CHUNK_SIZE
+
+MAX_MUTATION_WORKERS = 8
+
+## Lifecycle action -> (client method, response key listing the affected instances)
+MUTATIONS = {
+    'terminate': ('terminate_instances', 'TerminatingInstances'),
+    'start': ('start_instances', 'StartingInstances'),
+    'stop': ('stop_instances', 'StoppingInstances'),
+    'reboot': ('reboot_instances', None)
+}
+
+## Errors caused by some of the IDs in a call. Any other error (permissions, dry
+## runs, credentials, throttling) applies to the whole call and fails the chunk
+INSTANCE_ERRORS = {
+    'IncorrectInstanceState',
+    'InvalidInstanceID.NotFound',
+    'InvalidInstanceID.Malformed',
+    'OperationNotPermitted',
+    'UnsupportedOperation'
+}
+
+class MutationResult:
+    """
+    Per instance outcome of a batch mutation. succeeded maps instance IDs to
+    their new state (None if the API doesn't report one), failed maps them to
+    (error code, message).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.succeeded = {}
+        self.failed = {}
+
+def _mutate_chunk(ec2_cli, action, instance_ids, result):
+    """
+    Apply action to instance_ids in one call. EC2 rejects the whole call when
+    any one ID can't take the action, so a chunk rejected over some of its
+    instances is split in halves until the offending IDs are isolated and
+    reported on their own.
+    """
+    from botocore.exceptions import ClientError
+
+    method, response_key = MUTATIONS[action]
+    try:
+        response = getattr(ec2_cli, method)(InstanceIds=instance_ids)
+    except ClientError as e:
+        if len(instance_ids) > 1 and e.response['Error'].get('Code') in INSTANCE_ERRORS:
+            half = len(instance_ids) // 2
+            _mutate_chunk(ec2_cli, action, instance_ids[:half], result)
+            _mutate_chunk(ec2_cli, action, instance_ids[half:], result)
+            return
+
+        error = e.response['Error']
+        with result.lock:
+            for instance_id in instance_ids:
+                result.failed[instance_id] = (error.get('Code'), error.get('Message', ''))
+        return
+
+    states = {}
+    if response_key is not None:
+        states = { inst['InstanceId']: inst['CurrentState']['Name'] for inst in response[response_key] }
+    with result.lock:
+        for instance_id in instance_ids:
+            result.succeeded[instance_id] = states.get(instance_id)
+
+def mutate_instances(ec2_cli, action, instance_ids, chunk_size=MUTATION_CHUNK_SIZE,
+                     max_workers=MAX_MUTATION_WORKERS):
+    """
+    Apply a lifecycle action ('terminate', 'start', 'stop' or 'reboot') to
+    instance_ids in concurrent chunks of at most chunk_size IDs. Failures are
+    confined to the instances that caused them. Returns a MutationResult.
+    """
+    result = MutationResult()
+    instance_ids = list(dict.fromkeys(instance_ids))
+    chunks = [instance_ids[i:i + chunk_size] for i in range(0, len(instance_ids), chunk_size)]
+    if not chunks:
+        return result
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as pool:
+        futures = [pool.submit(_mutate_chunk, ec2_cli, action, chunk, result) for chunk in chunks]
+        for future in futures:
+            future.result()
+
+    return result
@@ -1,2 +1,48 @@
 RED_TEXT = '\033[91m'
-RESET_TEXT = '\033[00m'
\ No newline at end of file
+RESET_TEXT = '\033[00m'
+HIGHLIGHT_TEXT = '\033[93m'
+## Default number of hosts a parallel ssh/scp/rsync talks to at once
+DEFAULT_MAX_PARALLEL = 32
+
+## How long an idle SSH control master stays up
+SSH_CONTROL_PERSIST = '10m'
+
+## Seconds ssh --wait waits for every host to accept SSH connections
+SSH_WAIT_TIMEOUT = 300
+
+## raw: children write straight to the terminal
+## prefix: every line is streamed with an index/host prefix
+## collapse: identical outputs are grouped and printed once per group
+OUTPUT_MODES = ('raw', 'prefix', 'collapse')
+
+## Seconds a lifecycle --wait waits for its instances or image
+LIFECYCLE_WAIT_TIMEOUT = 900
+
+## Largest number of instances a single launch request asks for
+LAUNCH_CHUNK_SIZE = 25
+
+## text: the human readable tables
+## json: one array of records once everything is resolved
+## ndjson: one record per line, streamed as results arrive
+## csv: a header row followed by one row per record
+OUTPUT_FORMATS = ('text', 'json', 'ndjson', 'csv')
+
+## Sustained and burst request rates of the shared per endpoint API limiter, close to
+## the EC2 limits for describe calls. Throttling halves the rate down to API_MIN_RATE
+API_RATE = 20
+API_BURST = 100
+API_MIN_RATE = 1
+
+## Attempts per API call, throttled and transient errors are retried with backoff
+API_MAX_ATTEMPTS = 8
+
+## describe_instances accepts at most this many instance IDs per request
+DESCRIBE_BATCH_SIZE = 1000
+
+## Instance IDs per terminate/start/stop/reboot call, chunks run concurrently
+MUTATION_CHUNK_SIZE = 100
+
+## Seconds between info --watch refreshes, and between its full re-queries of the
+## contexts (the refreshes in between only describe instances in transition)
+WATCH_INTERVAL = 5
+WATCH_RECONCILE_INTERVAL = 60
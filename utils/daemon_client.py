@@ -0,0 +1,88 @@
+import json
+import os
+import signal
+import socket
+import sys
+
+from pathlib import Path
+
+def daemon_socket_path():
+    return Path.home() / '.manec2_daemon.sock'
+
+def daemon_pid_path():
+    return Path.home() / '.manec2_daemon.pid'
+
+def source_version():
+    """
+    Fingerprint of the manec2 sources, changes when any module is edited or
+    the package is upgraded.
+    """
+    ## The package is one level deep, a recursive walk would cost every command milliseconds
+    package_dir = Path(__file__).resolve().parent.parent
+    mtimes = [path.stat().st_mtime_ns for pattern in ('*.py', '*/*.py') for path in package_dir.glob(pattern)]
+    return f'{len(mtimes)}-{max(mtimes, default=0)}'
+
+def _needs_terminal(args):
+    """
+    True for commands that need this terminal as their controlling terminal,
+    which a daemon worker can't have: ec2 and asg ssh sessions without a
+    command and ec2 ssh --sudo, which allocates a tty.
+    """
+    for i in range(len(args) - 1):
+        if args[i:i + 2] in (['ec2', 'ssh'], ['asg', 'ssh']):
+            ssh_args = args[i + 2:]
+            has_command = any(arg.startswith(('-c', '--comm')) for arg in ssh_args)
+            return not has_command or any(arg in ('-s', '--sudo') for arg in ssh_args)
+
+    return False
+
+def forward_to_daemon(args):
+    """
+    Run the command in args in a running manec2 daemon. The daemon's worker gets
+    this process's stdin, stdout and stderr, so prompts, ssh sessions and
+    output behave as if the command ran here. Returns the command's exit code,
+    or None if no daemon is reachable and the command should run locally.
+    """
+    ## Kept free of manec2 imports, this runs before every command
+    if os.environ.get('MANEC2_NO_DAEMON') or not hasattr(socket, 'send_fds') \
+            or _needs_terminal(args):
+        return None
+
+    path = daemon_socket_path()
+    if not path.exists():
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(path))
+        request = json.dumps({ 'argv': args, 'cwd': os.getcwd(), 'env': dict(os.environ),
+                               'version': source_version() })
+        socket.send_fds(sock, [request.encode() + b'\n'], [0, 1, 2])
+    except OSError:
+        sock.close()
+        return None
+
+    with sock, sock.makefile('r') as replies:
+        worker_pid = None
+        while True:
+            try:
+                line = replies.readline()
+            except KeyboardInterrupt:
+                ## The worker is not in the terminal's process group, pass ^C on
+                if worker_pid is not None:
+                    os.kill(worker_pid, signal.SIGINT)
+                continue
+
+            if not line:
+                print('manec2 daemon closed the connection', file=sys.stderr)
+                return 1
+
+            reply = json.loads(line)
+            if 'stale' in reply:
+                print('manec2 daemon runs an older version of manec2, running the command without it. '
+                      'Restart it with `manec2 daemon stop` and `manec2 daemon start`', file=sys.stderr)
+                return None
+            if 'pid' in reply:
+                worker_pid = reply['pid']
+            else:
+                return reply['exit']
@@ -0,0 +1,51 @@
+import hashlib
+import os
+import shlex
+
+def file_digest(path):
+    """
+    Return the hex SHA-256 digest of a local file, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as local_file:
+        for chunk in iter(lambda: local_file.read(1 << 20), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def quote_remote_path(path):
+    """
+    shlex.quote a remote path but keep a leading ~/ expandable, like scp does.
+    """
+    if path == '~':
+        return path
+    if path.startswith('~/'):
+        return '~/' + shlex.quote(path[2:])
+
+    return shlex.quote(path)
+
+def remote_digest_command(file, location):
+    """
+    Remote shell command printing the SHA-256 of the copy 'scp file host:location'
+    would write: location/basename(file) if location is a directory, else
+    location itself. Prints nothing if there is no copy.
+    """
+    location = quote_remote_path(location)
+    target = shlex.quote(os.path.basename(file))
+    return f'if [ -d {location} ]; then p={location}/{target}; else p={location}; fi; ' \
+        + '[ -f "$p" ] && sha256sum "$p"'
+
+def parse_digest(output):
+    """
+    Return the digest from sha256sum output, or None.
+    """
+    fields = output.split()
+    return fields[0] if fields else None
+
+def format_bytes(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}'
+        size /= 1024
+
+    return f'{size:.1f} TiB'
@@ -0,0 +1,186 @@
+import hashlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from manec2.utils.constants import DEFAULT_MAX_PARALLEL, RED_TEXT, RESET_TEXT
+from manec2.utils.trace import span
+
+_output_lock = threading.Lock()
+
+class HostResult:
+    """
+    Outcome of running a host's commands.
+    """
+    def __init__(self, index, host, returncode, elapsed, spool=None, stdout=''):
+        self.index = index
+        self.host = host
+        self.returncode = returncode
+        self.elapsed = elapsed
+        ## Temporary file with the host's output in collapse mode
+        self.spool = spool
+        ## Decoded stdout in capture mode
+        self.stdout = stdout
+
+    @property
+    def succeeded(self):
+        return self.returncode == 0
+
+def _pump_lines(stream, out, prefix):
+    for line in iter(stream.readline, b''):
+        line = line.decode(errors='replace')
+        if not line.endswith('\n'):
+            line += '\n'
+        with _output_lock:
+            out.write(prefix + line)
+            out.flush()
+
+    stream.close()
+
+def _run_prefixed(cmd, prefix):
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr_pump = threading.Thread(target=_pump_lines, args=(proc.stderr, sys.stderr, prefix))
+    stderr_pump.start()
+    _pump_lines(proc.stdout, sys.stdout, prefix)
+    stderr_pump.join()
+    return proc.wait()
+
+def _run_host(index, host, commands, output='raw'):
+    spool = None
+    if output == 'collapse':
+        ## Spooled to disk so large outputs are never held in memory
+        spool = tempfile.TemporaryFile()
+
+    start = time.monotonic()
+    returncode = 0
+    stdout = ''
+    for cmd in commands:
+        with span(host, 'subprocess', index=index, command=cmd[0]) as trace_args:
+            if output == 'prefix':
+                returncode = _run_prefixed(cmd, f'[{index}] {host}: ')
+            elif output == 'collapse':
+                returncode = subprocess.run(cmd, stdout=spool, stderr=subprocess.STDOUT).returncode
+            elif output == 'quiet':
+                returncode = subprocess.run(cmd, stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL).returncode
+            elif output == 'capture':
+                proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+                returncode = proc.returncode
+                stdout += proc.stdout.decode(errors='replace')
+            else:
+                returncode = subprocess.run(cmd).returncode
+            trace_args['returncode'] = returncode
+
+        if returncode != 0:
+            break
+
+    return HostResult(index, host, returncode, time.monotonic() - start, spool, stdout)
+
+def output_mode(options, host_count):
+    """
+    Return the output mode requested with --output. Parallel runs over several
+    hosts default to prefixed lines so their output never interleaves mid-line.
+    """
+    mode = getattr(options, 'output', None)
+    if mode is not None:
+        return mode
+
+    return 'prefix' if options.parallel and host_count > 1 else 'raw'
+
+def run_on_hosts(host_commands, parallel=False, max_parallel=DEFAULT_MAX_PARALLEL,
+                 output='raw'):
+    """
+    Run each host's commands in order, stopping at the first failing one.
+    host_commands is a list of (index, host, [command, ...]). With parallel set,
+    at most max_parallel hosts run at once. output is one of OUTPUT_MODES,
+    'quiet', which discards all output, or 'capture', which keeps stdout in
+    HostResult.stdout and is meant for short outputs. Collapsed output is
+    printed once every host is done. Returns a HostResult per host in the order
+    given.
+    """
+    if not parallel or max_parallel <= 1 or len(host_commands) <= 1:
+        results = [_run_host(*host_command, output) for host_command in host_commands]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_parallel, len(host_commands))) as pool:
+            futures = [pool.submit(_run_host, *host_command, output) for host_command in host_commands]
+            results = [future.result() for future in futures]
+
+    if output == 'collapse':
+        print_collapsed(results)
+
+    return results
+
+def _format_indices(indices):
+    """
+    Format sorted indices as ranges, e.g. [0, 1, 2, 5] -> '0-2,5'.
+    """
+    ranges = []
+    for index in indices:
+        if ranges and ranges[-1][1] == index - 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+
+    return ','.join(str(lo) if lo == hi else f'{lo}-{hi}' for lo, hi in ranges)
+
+def _digest(spool):
+    spool.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: spool.read(1 << 16), b''):
+        digest.update(chunk)
+
+    return digest.digest()
+
+def print_collapsed(results):
+    """
+    Print the spooled output of every host once per group of identical outputs,
+    headed by the indices of the hosts in the group, like clush -b.
+    """
+    groups = {}
+    for res in results:
+        groups.setdefault(_digest(res.spool), []).append(res)
+
+    for group in groups.values():
+        header = _format_indices(sorted(res.index for res in group))
+        print('-' * 16)
+        print(f'{header} ({len(group)} hosts)')
+        print('-' * 16)
+        sys.stdout.flush()
+
+        spool = group[0].spool
+        spool.seek(0)
+        shutil.copyfileobj(spool, sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+
+    for res in results:
+        res.spool.close()
+        res.spool = None
+
+def _exit_code(returncode):
+    ## A host killed by a signal reports -signal, exit like a shell would
+    return 128 - returncode if returncode < 0 else returncode
+
+def report_results(results, parallel, slowest=3):
+    """
+    Print a summary of the host results of a parallel run to stderr and exit
+    non-zero if any host failed. A single host exits with its own return code.
+    """
+    failures = [res for res in results if not res.succeeded]
+
+    if parallel and len(results) > 1:
+        print(f'{len(results) - len(failures)}/{len(results)} hosts succeeded', file=sys.stderr)
+        for res in failures:
+            print(RED_TEXT + f'  {res.index:2d}  {res.host}  failed with exit code {res.returncode}'
+                + RESET_TEXT, file=sys.stderr)
+
+        print('Slowest hosts:', file=sys.stderr)
+        for res in sorted(results, key=lambda res: res.elapsed, reverse=True)[:slowest]:
+            print(f'  {res.index:2d}  {res.host}  {res.elapsed:.2f}s', file=sys.stderr)
+
+    if failures:
+        sys.exit(_exit_code(failures[0].returncode) if len(results) == 1 else 1)
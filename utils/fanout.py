@@ -0,0 +1,55 @@
+import copy
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_FANOUT_WORKERS = 16
+
+def _query_pair(options, profile, region, query):
+    pair_options = copy.copy(options)
+    pair_options.profile = profile
+    pair_options.region = region
+
+    start = time.monotonic()
+    try:
+        result, error = query(pair_options), None
+    except Exception as e:
+        ## One unreachable region or profile must not hide the others
+        result, error = None, e
+
+    return profile, region, result, error, time.monotonic() - start
+
+def fan_out(options, query):
+    """
+    Run query(options) for every (profile, region) pair in options.profiles and
+    options.regions concurrently, with options.profile and options.region set
+    to the pair. Returns (profile, region, result) for every pair that
+    succeeded, in pair order, after printing per-pair latency to stderr.
+    """
+    profiles = getattr(options, 'profiles', None) or [options.profile]
+    pairs = [(profile, region) for profile in profiles for region in options.regions]
+
+    with ThreadPoolExecutor(max_workers=min(MAX_FANOUT_WORKERS, len(pairs))) as pool:
+        futures = [pool.submit(_query_pair, options, profile, region, query) for profile, region in pairs]
+        outcomes = [future.result() for future in futures]
+
+    results = []
+    for profile, region, result, error, elapsed in outcomes:
+        profile_name = profile if profile is not None else 'default'
+        if error is not None:
+            print(f'  {region:15}  {profile_name:12}  {elapsed * 1000:7.0f} ms  failed: {error}',
+                file=sys.stderr)
+            continue
+
+        print(f'  {region:15}  {profile_name:12}  {elapsed * 1000:7.0f} ms', file=sys.stderr)
+        results.append((profile, region, result))
+
+    return results
+
+def is_multi_target(options):
+    """
+    True if options select more than one region or profile.
+    """
+    profiles = getattr(options, 'profiles', None) or [options.profile]
+    return len(getattr(options, 'regions', [options.region])) * len(profiles) > 1
@@ -2,8 +2,12 @@ class Instance:
 	"""
 	Class for an AWS EC2 node.
 	"""
+	## Contexts can hold thousands of nodes, keep each record small
+	__slots__ = ('id', 'type', 'placement', 'pr_ip', 'pub_ip', 'dns', 'last_observed_state',
+				 'placement_group', 'user', 'key')
+
 	def __init__(self, id='', inst_type='', placement='', pr_ip='', pub_ip='0', dns='0',
-				 last_state=''):
+				 last_state='', placement_group=''):
 		self.id = id
 		self.type = inst_type
 		self.placement = placement
@@ -11,6 +15,7 @@ class Instance:
 		self.pub_ip = pub_ip
 		self.dns = dns
 		self.last_observed_state = last_state
+		self.placement_group = placement_group
 
 	def set_user_key(self, user_key_tuple):
 		"""
@@ -27,6 +32,7 @@ class Instance:
 		json_rep['pub_ip'] = self.pub_ip
 		json_rep['dns'] = self.dns
 		json_rep['last_observed_state'] = self.last_observed_state
+		json_rep['placement_group'] = self.placement_group
 
 		return json_rep
 
@@ -34,6 +40,25 @@ class Instance:
 def deserialize(json_rep):
 	inst = Instance(json_rep['id'], json_rep['type'], json_rep['placement'],
 		json_rep['pr_ip'], json_rep['pub_ip'], json_rep['dns'],
-		json_rep['last_observed_state'])
+		json_rep['last_observed_state'], json_rep.get('placement_group', ''))
+
+	return inst
+
+def parse_instance(inst):
+	"""
+	Build an Instance from a describe_instances record.
+	"""
+	inst_id = inst['InstanceId']
+	inst_type = inst['InstanceType']
+	inst_place = inst['Placement']['AvailabilityZone']
+	state = inst['State']['Name']
+	pubip = '0'
+	dns = '0'
+	## Terminated instances have released their addresses
+	prip = inst.get('PrivateIpAddress', '0')
+	if state ==  'running':
+		pubip = inst.get('PublicIpAddress', '0')
+		dns = inst.get('PublicDnsName') or '0'
 
-	return inst
\ No newline at end of file
+	return Instance(inst_id, inst_type, inst_place, prip, pubip, dns, state,
+		inst['Placement'].get('GroupName', ''))
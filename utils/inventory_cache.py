@@ -0,0 +1,124 @@
+import fnmatch
+import json
+import os
+import threading
+import time
+
+from pathlib import Path
+
+from manec2.utils.instance_type import deserialize
+from manec2.utils.trace import span
+
+cache_file_path = Path.home() / '.manec2_cache.json'
+
+## Seconds a cached context stays valid
+CACHE_TTL = 300
+
+## Bumped whenever the serialized instance records change, older entries are ignored
+CACHE_VERSION = 2
+
+## Serializes read-modify-write cycles of threads querying several regions at once
+_cache_lock = threading.Lock()
+
+## Contexts with instances in any other state are about to change and are not cached
+STABLE_STATES = ('running', 'stopped')
+
+def _cache_key(profile, region, ctx):
+    profile = profile if profile is not None else 'default'
+    return f'{profile}/{region}/{ctx}'
+
+def _load_cache():
+    try:
+        with span('read inventory cache'), open(cache_file_path, 'r') as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+def _store_cache(cache):
+    tmp_path = cache_file_path.with_name(f'{cache_file_path.name}.{os.getpid()}.tmp')
+    try:
+        with span('write inventory cache'), open(tmp_path, 'w') as cache_file:
+            json.dump(cache, cache_file)
+        os.replace(tmp_path, cache_file_path)
+    except OSError:
+        ## The cache is only an optimization, never fail a command over it
+        pass
+
+def get_cached_instances(profile, region, ctxs, ttl=CACHE_TTL):
+    """
+    Return a dict mapping each context in ctxs with a fresh cache entry to its
+    list of instances. Missing or expired contexts are left out.
+    """
+    cache = _load_cache()
+    now = time.time()
+
+    cached = {}
+    for ctx in ctxs:
+        entry = cache.get(_cache_key(profile, region, ctx))
+        if entry is None or now - entry['timestamp'] > ttl or entry.get('version') != CACHE_VERSION:
+            continue
+
+        cached[ctx] = [deserialize(json_rep) for json_rep in entry['instances']]
+
+    return cached
+
+def cache_instances(profile, region, ctx_instances):
+    """
+    Store the instance lists of every context in ctx_instances whose instances
+    are all in a stable state.
+    """
+    with _cache_lock:
+        _update_cache(profile, region, ctx_instances)
+
+def _update_cache(profile, region, ctx_instances):
+    cache = _load_cache()
+    now = time.time()
+
+    updated = False
+    for ctx, instances in ctx_instances.items():
+        if not instances:
+            continue
+        if any(inst.last_observed_state not in STABLE_STATES for inst in instances):
+            updated = cache.pop(_cache_key(profile, region, ctx), None) is not None or updated
+            continue
+
+        cache[_cache_key(profile, region, ctx)] = {
+            'timestamp': now,
+            'version': CACHE_VERSION,
+            'instances': [inst.serialize() for inst in instances]
+        }
+        updated = True
+
+    if updated:
+        _store_cache(cache)
+
+def invalidate_instances(profile, region, ctxs=None, instance_ids=()):
+    """
+    Drop the cache entries of the given contexts, or of every context in the
+    profile and region if ctxs is None. Contexts are Name tag patterns, so an
+    entry is stale when its context and one of ctxs match each other either
+    way (stopping 'web*' changes 'web1', creating 'web3' changes 'web*'), or
+    when it holds one of instance_ids.
+    """
+    with _cache_lock:
+        _drop_entries(profile, region, ctxs, set(instance_ids))
+
+def _is_stale(ctx, entry, ctxs, instance_ids):
+    if any(fnmatch.fnmatchcase(ctx, pattern) or fnmatch.fnmatchcase(pattern, ctx) for pattern in ctxs):
+        return True
+
+    return any(json_rep['id'] in instance_ids for json_rep in entry.get('instances', []))
+
+def _drop_entries(profile, region, ctxs, instance_ids):
+    cache = _load_cache()
+    if not cache:
+        return
+
+    prefix = _cache_key(profile, region, '')
+    stale_keys = [key for key in cache if key.startswith(prefix) and \
+                  (ctxs is None or _is_stale(key[len(prefix):], cache[key], ctxs, instance_ids))]
+
+    for key in stale_keys:
+        cache.pop(key)
+    if stale_keys:
+        _store_cache(cache)
@@ -0,0 +1,122 @@
+import sys
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from manec2.utils.constants import LAUNCH_CHUNK_SIZE
+
+## The (AZ, type) pair is out of capacity or can not host the type, try another
+CAPACITY_ERRORS = ('InsufficientInstanceCapacity', 'InsufficientHostCapacity',
+                   'InsufficientReservedInstanceCapacity', 'Unsupported')
+
+## Launching again will not help
+FATAL_ERRORS = ('InstanceLimitExceeded', 'VcpuLimitExceeded', 'MaxSpotInstanceCountExceeded')
+
+MAX_LAUNCH_WORKERS = 8
+
+def _launch_args(base_args, count, az, inst_type):
+    args = dict(base_args)
+    args['MinCount'] = 1
+    args['MaxCount'] = count
+    args['InstanceType'] = inst_type
+    if inst_type != 't2.micro':
+        args['EbsOptimized'] = True
+    else:
+        args.pop('EbsOptimized', None)
+
+    placement = dict(args.get('Placement', {}))
+    if az is not None:
+        placement['AvailabilityZone'] = az
+    if placement:
+        args['Placement'] = placement
+
+    return args
+
+def _launch_chunk(ec2_cli, base_args, count, az, inst_type):
+    """
+    Launch up to count instances. Returns (instance_ids, error_code) for
+    capacity and limit errors, raises any other error.
+    """
+    from botocore.exceptions import ClientError
+
+    try:
+        response = ec2_cli.run_instances(**_launch_args(base_args, count, az, inst_type))
+        return [inst['InstanceId'] for inst in response['Instances']], None
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code not in CAPACITY_ERRORS and code not in FATAL_ERRORS:
+            raise
+        return [], code
+
+def sharded_launch(ec2_cli, base_args, count, azs, inst_types, chunk_size=LAUNCH_CHUNK_SIZE):
+    """
+    Launch count instances in concurrent chunks of at most chunk_size, spread
+    round robin over azs (None lets EC2 pick) and the first of inst_types.
+    Chunks use MinCount=1 so EC2 hands out whatever capacity it has. A chunk
+    that comes back short or out of capacity is re-split over the (AZ, type)
+    pairs that still have capacity, moving on to the fallback types once the
+    preferred type is exhausted everywhere.
+
+    Returns the list of launched instance IDs, which may be short of count.
+    """
+    start = time.monotonic()
+    azs = list(azs) if azs else [None]
+    candidates = [(az, inst_type) for inst_type in inst_types for az in azs]
+    exhausted = set()
+    launched = []
+    launched_per_candidate = {}
+
+    remaining = count
+    while remaining > 0:
+        live = [cand for cand in candidates if cand not in exhausted]
+        if not live:
+            break
+
+        ## Spread over the AZs of the most preferred type that still has capacity
+        preferred_type = live[0][1]
+        live = [cand for cand in live if cand[1] == preferred_type]
+
+        chunks = []
+        for i in range(0, remaining, chunk_size):
+            chunks.append((min(chunk_size, remaining - i),) + live[len(chunks) % len(live)])
+
+        with ThreadPoolExecutor(max_workers=min(MAX_LAUNCH_WORKERS, len(chunks))) as pool:
+            futures = [pool.submit(_launch_chunk, ec2_cli, base_args, chunk_count, az, inst_type)
+                       for chunk_count, az, inst_type in chunks]
+            outcomes = []
+            unexpected = None
+            for future in futures:
+                try:
+                    outcomes.append(future.result())
+                except Exception as e:
+                    ## Not a capacity problem, e.g. a bad launch template or credentials
+                    outcomes.append(([], None))
+                    unexpected = unexpected or e
+
+        fatal = None
+        for (chunk_count, az, inst_type), (instance_ids, error) in zip(chunks, outcomes):
+            launched += instance_ids
+            key = (az, inst_type)
+            launched_per_candidate[key] = launched_per_candidate.get(key, 0) + len(instance_ids)
+
+            if error in FATAL_ERRORS:
+                fatal = error
+            elif len(instance_ids) < chunk_count:
+                ## Got less than asked for, the pair is out of capacity for now
+                exhausted.add(key)
+
+        if unexpected is not None:
+            print(f'Launched {len(launched)}/{count} instances before the launch failed', file=sys.stderr)
+            raise unexpected
+
+        remaining = count - len(launched)
+        if fatal is not None:
+            print(f'Stopping launch: {fatal}', file=sys.stderr)
+            break
+
+    for (az, inst_type), launched_count in launched_per_candidate.items():
+        if launched_count:
+            print(f'  {launched_count:4d}  {inst_type}  {az or "any AZ"}')
+    print(f'Launched {len(launched)}/{count} instances in {time.monotonic() - start:.1f}s')
+
+    return launched
@@ -1,16 +1,46 @@
+import functools
 import os
-import yaml
 
 from pathlib import Path
 
+from manec2.utils.trace import span
+
 config_file_path = Path.home() / '.manec2_config.yaml'
-default_config = {}
-if os.path.exists(config_file_path):
-    default_config = yaml.safe_load(open(config_file_path, 'r'))
+
+@functools.lru_cache(maxsize=None)
+def _load_config():
+    if not os.path.exists(config_file_path):
+        return {}
+
+    with span('load config'):
+        ## yaml is only imported by commands that need the config
+        import yaml
+        with open(config_file_path, 'r') as config_file:
+            return yaml.safe_load(config_file) or {}
 
 def get_default_config(options):
+    default_config = _load_config()
     if not default_config:
         return {}
 
     profile = options.profile if options.profile is not None else 'default'
-    return default_config[profile]
\ No newline at end of file
+    return default_config[profile]
+
+def get_ssh_options(options):
+    """
+    Return the (user, key) to ssh with, from --user/--key or the profile's
+    SSHOptions in the config file. Exits if either is missing.
+    """
+    ssh_options = get_default_config(options).get('SSHOptions', {})
+
+    ssh_user = options.user if options.user is not None else ssh_options.get('User', None)
+    if ssh_user is None:
+        print("No default user found. Please provide a user (--user)")
+        exit(13)
+
+    ssh_key = options.key if options.key is not None else ssh_options.get('Keys', {}).get(options.region, None)
+    if ssh_key is None:
+        print("No default key found. Please provide an SSH key (--key)")
+        exit(13)
+
+    return ssh_user, ssh_key
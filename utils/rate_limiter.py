@@ -0,0 +1,148 @@
+import collections
+import sys
+import threading
+import time
+
+from manec2.utils.constants import API_BURST, API_MAX_ATTEMPTS, API_MIN_RATE, API_RATE
+
+## Error codes AWS uses when a caller is over its request rate
+THROTTLE_ERRORS = ('RequestLimitExceeded', 'Throttling', 'ThrottlingException',
+                   'TooManyRequestsException', 'RequestThrottled', 'RequestThrottledException',
+                   'SlowDown', 'EC2ThrottledException', 'PriorRequestNotComplete')
+
+class TokenBucket:
+    """
+    Token bucket shared by every thread calling one API endpoint. Each request
+    attempt takes a token. The refill rate adapts to the endpoint: it is halved
+    on every throttled response and grows back slowly with every successful
+    one, up to the configured rate.
+    """
+    def __init__(self, rate=API_RATE, burst=API_BURST, min_rate=API_MIN_RATE):
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """
+        Take a token, sleeping until one is available. Returns the seconds spent
+        waiting.
+        """
+        waited = 0
+        while True:
+            with self.lock:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+
+            time.sleep(delay)
+            waited += delay
+
+    def throttled(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            ## Drain the bucket so the next attempts are spread at the lower rate
+            self.tokens = min(self.tokens, 0)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+class ApiStats:
+    """
+    Counters of API attempts, throttled responses and limiter waits.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.attempts = collections.Counter()
+        self.throttled = collections.Counter()
+        self.wait_time = 0
+
+    def record(self, operation, throttled=False, waited=0):
+        with self.lock:
+            self.attempts[operation] += 1
+            self.wait_time += waited
+            if throttled:
+                self.throttled[operation] += 1
+
+_buckets_lock = threading.Lock()
+_buckets = {}
+api_stats = ApiStats()
+
+def get_bucket(profile, region, service):
+    """
+    The bucket of an endpoint. Limits apply per account and region, so every
+    client for the same (profile, region, service) shares one.
+    """
+    key = (profile, region, service)
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket()
+            _buckets[key] = bucket
+
+    return bucket
+
+def throttle_code(response):
+    """
+    The throttling error code of a parsed response, or None.
+    """
+    code = (response or {}).get('Error', {}).get('Code')
+    return code if code in THROTTLE_ERRORS else None
+
+def retry_config():
+    """
+    botocore client config retrying throttled and transient errors with
+    jittered exponential backoff.
+    """
+    from botocore.config import Config
+    return Config(retries={ 'mode': 'standard', 'max_attempts': API_MAX_ATTEMPTS })
+
+def limit_client(client, bucket):
+    """
+    Make every request attempt of client, retries included, take a token from
+    bucket and feed throttled responses back into it.
+    """
+    pending_waits = threading.local()
+
+    ## request-created fires once per attempt, right before it is signed and sent
+    def before_attempt(**kwargs):
+        pending_waits.waited = bucket.acquire()
+
+    def needs_retry(response, operation, **kwargs):
+        throttled = response is not None and throttle_code(response[1]) is not None
+        if throttled:
+            bucket.throttled()
+        elif response is not None:
+            bucket.succeeded()
+        api_stats.record(operation.name, throttled, getattr(pending_waits, 'waited', 0))
+        pending_waits.waited = 0
+
+    client.meta.events.register('request-created', before_attempt)
+    client.meta.events.register('needs-retry', needs_retry)
+
+def report_throttling():
+    """
+    Print a note to stderr if any API call was throttled during the command,
+    and start counting afresh.
+    """
+    with api_stats.lock:
+        throttled = sum(api_stats.throttled.values())
+        operations = ', '.join(f'{op} x{count}' for op, count in api_stats.throttled.most_common())
+        wait_time = api_stats.wait_time
+        api_stats.attempts.clear()
+        api_stats.throttled.clear()
+        api_stats.wait_time = 0
+
+    if throttled:
+        print(f'{throttled} AWS API requests were throttled ({operations}), '
+              f'{wait_time:.1f}s spent rate limiting', file=sys.stderr)
@@ -0,0 +1,91 @@
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from manec2.utils.constants import DEFAULT_MAX_PARALLEL, RED_TEXT, RESET_TEXT, \
+    SSH_WAIT_TIMEOUT
+from manec2.utils.executor import HostResult
+from manec2.utils.trace import span
+
+PROBE_TIMEOUT = 5
+INITIAL_BACKOFF = 1
+MAX_BACKOFF = 15
+
+## Options for the probe only, it must never block on a prompt
+PROBE_SSH_OPTIONS = [
+    '-o', 'BatchMode=yes',
+    '-o', 'StrictHostKeyChecking=accept-new',
+    '-o', f'ConnectTimeout={PROBE_TIMEOUT}'
+]
+
+def _port_open(host, port=22):
+    try:
+        with socket.create_connection((host, port), timeout=PROBE_TIMEOUT):
+            return True
+    except OSError:
+        return False
+
+def _ssh_ready(host, ssh_command_test, ssh_slots):
+    with ssh_slots, span(host, 'subprocess', command='ssh probe') as trace_args:
+        try:
+            trace_args['returncode'] = subprocess.run(ssh_command_test, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL, timeout=PROBE_TIMEOUT * 2).returncode
+            return trace_args['returncode'] == 0
+        except subprocess.TimeoutExpired:
+            trace_args['returncode'] = 'timeout'
+            return False
+
+def _wait_for_host(index, host, ssh_command_test, deadline, ssh_slots):
+    start = time.monotonic()
+    backoff = INITIAL_BACKOFF
+    while True:
+        ## A closed port 22 is much cheaper to detect than a failed SSH handshake
+        if _port_open(host) and _ssh_ready(host, ssh_command_test, ssh_slots):
+            return HostResult(index, host, 0, time.monotonic() - start)
+
+        if time.monotonic() + backoff > deadline:
+            return HostResult(index, host, 255, time.monotonic() - start)
+
+        ## Full jitter keeps hosts launched together from probing in lockstep
+        time.sleep(random.uniform(backoff / 2, backoff))
+        backoff = min(backoff * 2, MAX_BACKOFF)
+
+def wait_for_ssh(host_probes, timeout=SSH_WAIT_TIMEOUT, max_parallel=DEFAULT_MAX_PARALLEL):
+    """
+    Probe every host concurrently until it accepts SSH connections or timeout
+    seconds pass. host_probes is a list of (index, host, ssh_base) where ssh_base
+    is an ssh command line ending in user@host. At most max_parallel ssh probes
+    run at once. Prints the time each host took to become ready and exits if
+    any host never did.
+    """
+    if not host_probes:
+        return []
+
+    deadline = time.monotonic() + timeout
+    ssh_slots = threading.BoundedSemaphore(max(max_parallel, 1))
+
+    with ThreadPoolExecutor(max_workers=len(host_probes)) as pool:
+        futures = [pool.submit(_wait_for_host, index, host,
+                    ssh_base[:1] + PROBE_SSH_OPTIONS + ssh_base[1:] + ['exit'],
+                    deadline, ssh_slots)
+                   for index, host, ssh_base in host_probes]
+        results = [future.result() for future in futures]
+
+    failures = [res for res in results if not res.succeeded]
+    for res in results:
+        if res.succeeded:
+            print(f'  {res.index:2d}  {res.host}  ready after {res.elapsed:.1f}s', file=sys.stderr)
+        else:
+            print(RED_TEXT + f'  {res.index:2d}  {res.host}  not reachable after {res.elapsed:.1f}s'
+                + RESET_TEXT, file=sys.stderr)
+
+    if failures:
+        print(f'{len(failures)} hosts never accepted SSH connections. Failing...')
+        exit(15)
+
+    return results
@@ -0,0 +1,61 @@
+import csv
+import json
+import sys
+
+## Columns of an instance record, region and profile are added for multi-target queries
+INSTANCE_FIELDS = ['context', 'index', 'id', 'type', 'az', 'private_ip', 'public_ip', 'dns', 'state']
+TARGET_FIELDS = ['region', 'profile']
+
+def instance_record(ctx, index, inst, region=None, profile=None):
+    """
+    Structured form of inst. index is None when the position of inst in its
+    context is not known yet. Addresses manec2 shows as '0' become None.
+    """
+    record = {
+        'context': ctx,
+        'index': index,
+        'id': inst.id,
+        'type': inst.type,
+        'az': inst.placement,
+        'private_ip': inst.pr_ip if inst.pr_ip != '0' else None,
+        'public_ip': inst.pub_ip if inst.pub_ip != '0' else None,
+        'dns': inst.dns if inst.dns != '0' else None,
+        'state': inst.last_observed_state
+    }
+    if region is not None:
+        record['region'] = region
+        record['profile'] = profile
+
+    return record
+
+class RecordWriter:
+    """
+    Writes records to stdout in one of the structured OUTPUT_FORMATS. ndjson
+    and csv records are written and flushed as soon as they are given, json
+    records are held until close.
+    """
+    def __init__(self, fmt, fields, out=sys.stdout):
+        self.fmt = fmt
+        self.out = out
+        self.records = []
+        self.csv_writer = None
+        if fmt == 'csv':
+            self.csv_writer = csv.DictWriter(out, fieldnames=fields, extrasaction='ignore')
+            self.csv_writer.writeheader()
+
+    def write(self, record):
+        if self.fmt == 'json':
+            self.records.append(record)
+            return
+
+        if self.fmt == 'ndjson':
+            self.out.write(json.dumps(record) + '\n')
+        else:
+            self.csv_writer.writerow(record)
+        self.out.flush()
+
+    def close(self):
+        if self.fmt == 'json':
+            json.dump(self.records, self.out, indent=2)
+            self.out.write('\n')
+        self.out.flush()
@@ -0,0 +1,68 @@
+import sys
+
+from manec2.utils.constants import DEFAULT_MAX_PARALLEL
+from manec2.utils.executor import run_on_hosts
+
+def relay_distribute(hosts, direct_commands, relay_commands, seeds=1, fanout=2,
+                     max_parallel=DEFAULT_MAX_PARALLEL, output='prefix'):
+    """
+    Distribute a payload over hosts as a fan-out tree. The operator pushes to
+    the first seeds hosts with direct_commands(inst). Every round after that,
+    each host holding the payload pushes to up to fanout new hosts with
+    relay_commands(src_inst, dst_inst), so the number of holders grows
+    geometrically. Hosts whose relay transfer failed, or that could not be
+    reached from any holder, get a direct push at the end. Relaying stops as
+    soon as a round adds no holders.
+
+    hosts is a list of (index, inst). Returns a HostResult per host in the order
+    given, the result of the last transfer that targeted it.
+    """
+    final_results = {}
+    waiting = list(hosts)
+    seed_hosts, waiting = waiting[:max(seeds, 1)], waiting[max(seeds, 1):]
+
+    print(f'Relay round 0: operator -> {len(seed_hosts)} seeds', file=sys.stderr)
+    results = run_on_hosts([(i, inst.dns, direct_commands(inst)) for i, inst in seed_hosts],
+        True, max_parallel, output)
+
+    holders = []
+    fallback = []
+    for (i, inst), res in zip(seed_hosts, results):
+        final_results[i] = res
+        (holders if res.succeeded else fallback).append((i, inst))
+
+    relay_round = 1
+    while waiting and holders:
+        host_commands = []
+        targets = []
+        for src_i, src in holders:
+            for _ in range(fanout):
+                if not waiting:
+                    break
+                dst_i, dst = waiting.pop(0)
+                host_commands.append((dst_i, dst.dns, relay_commands(src, dst)))
+                targets.append((dst_i, dst))
+
+        print(f'Relay round {relay_round}: {len(holders)} holders -> {len(targets)} hosts',
+            file=sys.stderr)
+        results = run_on_hosts(host_commands, True, max_parallel, output)
+        new_holders = []
+        for (i, inst), res in zip(targets, results):
+            final_results[i] = res
+            (new_holders if res.succeeded else fallback).append((i, inst))
+
+        ## The holders can't reach their peers, the operator pushes to the rest
+        if not new_holders:
+            break
+        holders += new_holders
+        relay_round += 1
+
+    fallback += waiting
+    if fallback:
+        print(f'Relay fallback: operator -> {len(fallback)} hosts', file=sys.stderr)
+        results = run_on_hosts([(i, inst.dns, direct_commands(inst)) for i, inst in fallback],
+            True, max_parallel, output)
+        for (i, _), res in zip(fallback, results):
+            final_results[i] = res
+
+    return [final_results[i] for i, _ in hosts]
@@ -0,0 +1,140 @@
+import fnmatch
+import re
+
+## Selector keys and the Instance attribute each one matches
+SELECTOR_FIELDS = {
+    'id': 'id',
+    'type': 'type',
+    'az': 'placement',
+    'zone': 'placement',
+    'state': 'last_observed_state',
+    'prip': 'pr_ip',
+    'pubip': 'pub_ip',
+    'dns': 'dns',
+    'pg': 'placement_group'
+}
+
+## describe_instances filter for each selector key
+SELECTOR_EC2_FILTERS = {
+    'id': 'instance-id',
+    'type': 'instance-type',
+    'az': 'availability-zone',
+    'zone': 'availability-zone',
+    'state': 'instance-state-name',
+    'prip': 'private-ip-address',
+    'pubip': 'ip-address',
+    'dns': 'dns-name',
+    'pg': 'placement-group-name'
+}
+
+## States manec2 considers part of a context
+LIVE_STATES = ['stopped', 'stopping', 'pending', 'running']
+
+class Selector:
+    """
+    Compiled selection expressions. Every expression must match:
+      key=value[,value...]  where a value may use shell wildcards (type=c5.*)
+      N, N-M[,N-M...]       index ranges into the context sorted by ID
+    """
+    def __init__(self, exprs):
+        self.matchers = []
+        self.index_ranges = None
+        self.terms = []
+
+        for expr in exprs:
+            if '=' in expr:
+                key, values = expr.split('=', 1)
+                if key not in SELECTOR_FIELDS:
+                    raise ValueError(f"Unknown selector '{key}', use one of {', '.join(SELECTOR_FIELDS)}")
+
+                values = values.split(',')
+                self.terms.append((key, values))
+                pattern = '|'.join(fnmatch.translate(value) for value in values)
+                self.matchers.append((SELECTOR_FIELDS[key], re.compile(pattern).match))
+            else:
+                ranges = [self._parse_range(part) for part in expr.split(',')]
+                self.index_ranges = (self.index_ranges or []) + ranges
+
+    @staticmethod
+    def _parse_range(part):
+        try:
+            if '-' in part:
+                lo, hi = part.split('-', 1)
+                return int(lo), int(hi)
+            return int(part), int(part)
+        except ValueError:
+            raise ValueError(f"Invalid selector '{part}', expected key=value or an index range")
+
+    def server_filters(self):
+        """
+        describe_instances Filters equivalent to the key=value terms. State
+        terms are resolved against LIVE_STATES so they narrow, never widen, the
+        states a context is made of.
+        """
+        filters = []
+        for key, values in self.terms:
+            if key == 'state':
+                values = [state for state in LIVE_STATES \
+                          if any(fnmatch.fnmatchcase(state, value) for value in values)]
+            filters.append({ 'Name': SELECTOR_EC2_FILTERS[key], 'Values': values })
+
+        return filters
+
+    def matches(self, index, inst):
+        if self.index_ranges is not None \
+                and not any(lo <= index <= hi for lo, hi in self.index_ranges):
+            return False
+
+        return all(match(getattr(inst, attr)) for attr, match in self.matchers)
+
+    def select(self, indexed_instances):
+        """
+        Lazily yield the (index, inst) pairs that match, in one pass.
+        """
+        return ((i, inst) for i, inst in indexed_instances if self.matches(i, inst))
+
+def parse_selector(options):
+    """
+    Compile the --select expressions in options, or return None if there are
+    none. Exits on an invalid expression.
+    """
+    exprs = getattr(options, 'select', None)
+    if not exprs:
+        return None
+
+    try:
+        return Selector(exprs)
+    except ValueError as e:
+        print(e)
+        exit(13)
+
+def pushdown_filters(options, indices=-1):
+    """
+    describe_instances Filters equivalent to the --select terms, which let EC2
+    drop instances the command would discard anyway. Only for commands that
+    show no instance indices: indices are positions in the full context, so
+    commands that number instances resolve the full context (which can come
+    from the inventory cache) and select locally. Returns None when the
+    command addresses instances by position (--indices or index ranges).
+    """
+    selector = parse_selector(options)
+    if indices != -1 or (selector is not None and selector.index_ranges is not None):
+        return None
+
+    return selector.server_filters() if selector is not None else []
+
+def select_instances(instances, options, indices=-1):
+    """
+    Return (index, inst) pairs of instances at indices (-1 for all) that match
+    the --select expressions in options. Exits on an invalid expression.
+    """
+    if indices == -1:
+        indexed = enumerate(instances)
+    else:
+        indexed = ((i, instances[i]) for i in indices)
+
+    selector = parse_selector(options)
+    if selector is None:
+        return list(indexed)
+
+    return list(selector.select(indexed))
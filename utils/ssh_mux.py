@@ -0,0 +1,39 @@
+import os
+
+from pathlib import Path
+
+from manec2.utils.constants import SSH_CONTROL_PERSIST
+
+## Kept short, control socket paths are limited to ~100 characters
+control_dir_path = Path.home() / '.manec2_ssh'
+
+def ssh_mux_options(options, persist=SSH_CONTROL_PERSIST):
+    """
+    Return the ssh options that share one persistent control master per
+    (user, host), or no options if multiplexing is turned off with --no-mux.
+    The options can be passed to ssh and scp directly or through rsync -e.
+    """
+    if getattr(options, 'no_mux', False):
+        return []
+
+    os.makedirs(control_dir_path, mode=0o700, exist_ok=True)
+    return [
+        '-o', 'ControlMaster=auto',
+        '-o', f'ControlPath={control_dir_path}/%C',
+        '-o', f'ControlPersist={persist}'
+    ]
+
+def ssh_mux_commands(ssh_base, action):
+    """
+    Return the command that opens, checks or closes the control master behind
+    ssh_base, which is an ssh command line ending in user@host.
+    """
+    if action == 'open':
+        ## Creates the master if there is none, then leaves it running
+        return ssh_base + ['true']
+    if action == 'list':
+        return ssh_base[:-1] + ['-O', 'check', ssh_base[-1]]
+    if action == 'close':
+        return ssh_base[:-1] + ['-O', 'exit', ssh_base[-1]]
+
+    raise ValueError(f'Unknown mux action {action}')
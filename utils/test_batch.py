@@ -0,0 +1,59 @@
+import threading
+
+from botocore.exceptions import ClientError
+
+from manec2.utils.batch import mutate_instances
+
+class FakeEC2:
+    """
+    Records stop_instances calls. A call is rejected with error when it
+    includes any of the bad IDs, or always if bad is None.
+    """
+    def __init__(self, error, bad=None):
+        self.error = error
+        self.bad = bad
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def stop_instances(self, InstanceIds):
+        with self.lock:
+            self.calls.append(list(InstanceIds))
+        if self.bad is None or self.bad & set(InstanceIds):
+            raise ClientError({ 'Error': { 'Code': self.error, 'Message': 'rejected' } }, 'StopInstances')
+
+        return { 'StoppingInstances': [{ 'InstanceId': inst_id, 'CurrentState': { 'Name': 'stopping' } }
+                                       for inst_id in InstanceIds] }
+
+def _ids(count):
+    return [f'i-{i:04x}' for i in range(count)]
+
+def test_chunks_split_by_size():
+    ec2_cli = FakeEC2('IncorrectInstanceState', bad=set())
+    result = mutate_instances(ec2_cli, 'stop', _ids(10) + _ids(2), chunk_size=4)
+
+    assert sorted(len(call) for call in ec2_cli.calls) == [2, 4, 4]
+    assert result.succeeded == { inst_id: 'stopping' for inst_id in _ids(10) }
+    assert result.failed == {}
+
+def test_instance_errors_are_isolated():
+    ec2_cli = FakeEC2('IncorrectInstanceState', bad={'i-0005'})
+    result = mutate_instances(ec2_cli, 'stop', _ids(8), chunk_size=8)
+
+    assert list(result.failed) == ['i-0005']
+    assert result.failed['i-0005'] == ('IncorrectInstanceState', 'rejected')
+    assert sorted(result.succeeded) == [inst_id for inst_id in _ids(8) if inst_id != 'i-0005']
+
+def test_call_errors_fail_the_chunk_without_splitting():
+    ec2_cli = FakeEC2('UnauthorizedOperation')
+    result = mutate_instances(ec2_cli, 'stop', _ids(8), chunk_size=4)
+
+    assert len(ec2_cli.calls) == 2
+    assert sorted(result.failed) == _ids(8)
+    assert result.succeeded == {}
+
+def test_nothing_to_do():
+    ec2_cli = FakeEC2('UnauthorizedOperation')
+    result = mutate_instances(ec2_cli, 'stop', [])
+
+    assert ec2_cli.calls == []
+    assert result.succeeded == {} and result.failed == {}
@@ -0,0 +1,12 @@
+from manec2.utils.daemon_client import _needs_terminal
+
+def test_interactive_sessions_run_locally():
+    assert _needs_terminal(['ec2', 'ssh', 'web'])
+    assert _needs_terminal(['--profile', 'prod', 'asg', 'ssh', 'web-asg'])
+    assert _needs_terminal(['ec2', 'ssh', 'web', '-c', 'uptime', '--sudo'])
+
+def test_commands_are_forwarded():
+    assert not _needs_terminal(['ec2', 'ssh', 'web', '-c', 'uptime'])
+    assert not _needs_terminal(['asg', 'ssh', 'web-asg', '--comm=uptime'])
+    assert not _needs_terminal(['ec2', 'info', 'web'])
+    assert not _needs_terminal(['asg', 'scp', 'web-asg', 'file', '--put'])
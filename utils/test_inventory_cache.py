@@ -0,0 +1,55 @@
+import pytest
+
+from manec2.utils import inventory_cache
+from manec2.utils.instance_type import Instance
+from manec2.utils.inventory_cache import cache_instances, get_cached_instances, invalidate_instances
+
+@pytest.fixture(autouse=True)
+def cache_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(inventory_cache, 'cache_file_path', tmp_path / 'cache.json')
+
+def _inst(inst_id, state='running'):
+    return Instance(inst_id, 'c5.large', 'us-west-2a', '10.0.0.1', last_state=state)
+
+def _cached(ctxs):
+    return sorted(get_cached_instances(None, 'us-west-2', ctxs))
+
+def test_stop_pattern_drops_matching_contexts():
+    cache_instances(None, 'us-west-2', { 'web1': [_inst('i-1')], 'web2': [_inst('i-2')], 'db': [_inst('i-3')] })
+
+    ## ec2 stop 'web*'
+    invalidate_instances(None, 'us-west-2', ['web*'], ['i-1', 'i-2'])
+    assert _cached(['web1', 'web2', 'db']) == ['db']
+
+def test_create_drops_patterns_matching_the_context():
+    cache_instances(None, 'us-west-2', { 'web*': [_inst('i-1')], 'web1': [_inst('i-1')], 'db': [_inst('i-3')] })
+
+    ## ec2 create --ctx web3
+    invalidate_instances(None, 'us-west-2', ['web3'], ['i-9'])
+    assert _cached(['web*', 'web1', 'db']) == ['db', 'web1']
+
+def test_entries_holding_affected_instances_are_dropped():
+    cache_instances(None, 'us-west-2', { 'web1': [_inst('i-1')], 'canary': [_inst('i-1')], 'db': [_inst('i-3')] })
+
+    invalidate_instances(None, 'us-west-2', ['web1'], ['i-1'])
+    assert _cached(['web1', 'canary', 'db']) == ['db']
+
+def test_other_regions_and_profiles_are_kept():
+    cache_instances(None, 'us-west-2', { 'web1': [_inst('i-1')] })
+    cache_instances(None, 'us-east-1', { 'web1': [_inst('i-2')] })
+    cache_instances('prod', 'us-west-2', { 'web1': [_inst('i-3')] })
+
+    invalidate_instances(None, 'us-west-2', ['web*'], ['i-1'])
+    assert _cached(['web1']) == []
+    assert sorted(get_cached_instances(None, 'us-east-1', ['web1'])) == ['web1']
+    assert sorted(get_cached_instances('prod', 'us-west-2', ['web1'])) == ['web1']
+
+def test_whole_region_is_dropped_without_contexts():
+    cache_instances(None, 'us-west-2', { 'web1': [_inst('i-1')], 'db': [_inst('i-3')] })
+
+    invalidate_instances(None, 'us-west-2')
+    assert _cached(['web1', 'db']) == []
+
+def test_unstable_contexts_are_not_cached():
+    cache_instances(None, 'us-west-2', { 'web1': [_inst('i-1', 'pending')] })
+    assert _cached(['web1']) == []
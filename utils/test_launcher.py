@@ -0,0 +1,83 @@
+import itertools
+import threading
+
+import pytest
+
+from botocore.exceptions import ClientError
+
+from manec2.utils.launcher import sharded_launch
+
+class FakeEC2:
+    """
+    Records run_instances calls. (AZ, type) pairs in capacity have that many
+    instances left, pairs missing from it have unlimited capacity. An exhausted
+    pair raises InsufficientInstanceCapacity, or error if one is given.
+    """
+    def __init__(self, capacity=None, error=None):
+        self.capacity = dict(capacity or {})
+        self.error = error
+        self.calls = []
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+
+    def run_instances(self, **args):
+        key = (args.get('Placement', {}).get('AvailabilityZone'), args['InstanceType'])
+        with self.lock:
+            self.calls.append((key, args['MaxCount']))
+            if self.error is not None:
+                raise ClientError({ 'Error': { 'Code': self.error, 'Message': 'rejected' } }, 'RunInstances')
+
+            count = min(args['MaxCount'], self.capacity.get(key, args['MaxCount']))
+            if count == 0:
+                raise ClientError({ 'Error': { 'Code': 'InsufficientInstanceCapacity', 'Message': 'none left' } },
+                                  'RunInstances')
+            if key in self.capacity:
+                self.capacity[key] -= count
+
+            return { 'Instances': [{ 'InstanceId': f'i-{next(self.ids):04x}' } for _ in range(count)] }
+
+    def requested(self, key):
+        return sum(count for call_key, count in self.calls if call_key == key)
+
+def test_chunks_spread_round_robin_over_azs():
+    ec2_cli = FakeEC2()
+    launched = sharded_launch(ec2_cli, {}, 100, ['a', 'b'], ['c5.large'], chunk_size=25)
+
+    assert len(launched) == len(set(launched)) == 100
+    assert sorted(ec2_cli.calls) == [(('a', 'c5.large'), 25)] * 2 + [(('b', 'c5.large'), 25)] * 2
+
+def test_short_chunks_move_to_azs_with_capacity():
+    ec2_cli = FakeEC2({ ('a', 'c5.large'): 10 })
+    launched = sharded_launch(ec2_cli, {}, 50, ['a', 'b'], ['c5.large'], chunk_size=25)
+
+    assert len(launched) == 50
+    assert ec2_cli.requested(('b', 'c5.large')) == 40
+    ## a came back short, it isn't asked again
+    assert [count for key, count in ec2_cli.calls if key == ('a', 'c5.large')] == [25]
+
+def test_fallback_types_once_the_preferred_type_is_exhausted():
+    ec2_cli = FakeEC2({ ('a', 'c5.large'): 5, ('b', 'c5.large'): 0 })
+    launched = sharded_launch(ec2_cli, {}, 20, ['a', 'b'], ['c5.large', 'm5.large'], chunk_size=10)
+
+    assert len(launched) == 20
+    assert ec2_cli.requested(('a', 'm5.large')) + ec2_cli.requested(('b', 'm5.large')) == 15
+    assert all(key[1] == 'm5.large' for key, _ in ec2_cli.calls[2:])
+
+def test_partial_launch_when_capacity_runs_out():
+    ec2_cli = FakeEC2({ ('a', 'c5.large'): 7, ('b', 'c5.large'): 3 })
+    launched = sharded_launch(ec2_cli, {}, 40, ['a', 'b'], ['c5.large'], chunk_size=10)
+
+    assert len(launched) == 10
+    assert ec2_cli.capacity == { ('a', 'c5.large'): 0, ('b', 'c5.large'): 0 }
+
+def test_limit_errors_stop_the_launch():
+    ec2_cli = FakeEC2(error='VcpuLimitExceeded')
+    launched = sharded_launch(ec2_cli, {}, 30, ['a'], ['c5.large'], chunk_size=10)
+
+    assert launched == []
+    assert len(ec2_cli.calls) == 3
+
+def test_other_errors_are_raised():
+    ec2_cli = FakeEC2(error='InvalidParameterValue')
+    with pytest.raises(ClientError):
+        sharded_launch(ec2_cli, {}, 30, ['a'], ['c5.large'], chunk_size=10)
@@ -0,0 +1,15 @@
+from manec2 import parse_regions, region_aliases
+
+def test_names_and_abbreviations():
+    assert parse_regions('us-west-2') == ['us-west-2']
+    assert parse_regions('uw2,ue1') == ['us-west-2', 'us-east-1']
+
+def test_all_regions_once():
+    regions = parse_regions('all')
+    assert regions == sorted(set(region_aliases.values()))
+    assert len(regions) == len(set(regions))
+
+def test_unknown_or_missing_region():
+    assert parse_regions('mars-1') is None
+    assert parse_regions('uw2,mars-1') is None
+    assert parse_regions(None) is None
@@ -0,0 +1,44 @@
+import types
+
+from manec2.utils import relay
+from manec2.utils.executor import HostResult
+from manec2.utils.relay import relay_distribute
+
+def _hosts(count):
+    return [(i, types.SimpleNamespace(dns=f'host{i}')) for i in range(count)]
+
+def _fake_run(rounds, failing):
+    """
+    run_on_hosts stand-in recording the hosts of every call. Relay transfers,
+    marked by their ('relay', ...) command, fail for the dns names in failing.
+    """
+    def run_on_hosts(host_commands, parallel, max_parallel, output):
+        rounds.append([host for _, host, _ in host_commands])
+        return [HostResult(i, host, 1 if commands[0] == 'relay' and host in failing else 0, 0.1)
+                for i, host, commands in host_commands]
+
+    return run_on_hosts
+
+def _distribute(monkeypatch, count, failing=()):
+    rounds = []
+    monkeypatch.setattr(relay, 'run_on_hosts', _fake_run(rounds, set(failing)))
+    results = relay_distribute(_hosts(count), lambda inst: ['direct'],
+        lambda src, dst: ['relay'], seeds=1, fanout=2)
+
+    return rounds, results
+
+def test_holders_grow_every_round(monkeypatch):
+    rounds, results = _distribute(monkeypatch, 10)
+
+    assert [len(hosts) for hosts in rounds] == [1, 2, 6, 1]
+    assert all(res.succeeded for res in results)
+
+def test_failing_round_falls_back_at_once(monkeypatch):
+    rounds, results = _distribute(monkeypatch, 20, failing={f'host{i}' for i in range(1, 20)})
+
+    ## Seed, one failed relay round, then everything left goes direct
+    assert len(rounds) == 3
+    assert rounds[1] == ['host1', 'host2']
+    assert sorted(rounds[2]) == sorted(f'host{i}' for i in range(1, 20))
+    assert [res.host for res in results] == [f'host{i}' for i in range(20)]
+    assert all(res.succeeded for res in results)
@@ -0,0 +1,53 @@
+import argparse
+
+import pytest
+
+from manec2.utils.instance_type import Instance
+from manec2.utils.selector import Selector, pushdown_filters, select_instances
+
+def _options(*exprs):
+    return argparse.Namespace(select=list(exprs) or None)
+
+def _instances():
+    return [
+        Instance('i-0', 'c5.large', 'us-west-2a', '10.0.0.1', last_state='running'),
+        Instance('i-1', 't2.micro', 'us-west-2b', '10.0.0.2', last_state='stopped'),
+        Instance('i-2', 'c5.xlarge', 'us-west-2a', '10.0.0.3', last_state='running'),
+        Instance('i-3', 'c5.large', 'us-west-2b', '10.0.0.4', last_state='running')
+    ]
+
+def test_pushdown_without_select():
+    assert pushdown_filters(_options()) == []
+
+def test_pushdown_key_value_terms():
+    assert pushdown_filters(_options('type=c5.*', 'az=us-west-2a,us-west-2b')) == [
+        { 'Name': 'instance-type', 'Values': ['c5.*'] },
+        { 'Name': 'availability-zone', 'Values': ['us-west-2a', 'us-west-2b'] }
+    ]
+
+def test_pushdown_state_narrows_to_live_states():
+    assert pushdown_filters(_options('state=st*')) == [
+        { 'Name': 'instance-state-name', 'Values': ['stopped', 'stopping'] }
+    ]
+
+def test_no_pushdown_for_positional_selection():
+    assert pushdown_filters(_options('type=c5.large', '0-2')) is None
+    assert pushdown_filters(_options('type=c5.large'), indices=[0, 1]) is None
+
+def test_indices_count_within_the_whole_context():
+    selected = select_instances(_instances(), _options('type=c5.*'))
+    assert [(i, inst.id) for i, inst in selected] == [(0, 'i-0'), (2, 'i-2'), (3, 'i-3')]
+
+def test_index_ranges_combine_with_terms():
+    selected = select_instances(_instances(), _options('1-3', 'type=c5.large'))
+    assert [(i, inst.id) for i, inst in selected] == [(3, 'i-3')]
+
+def test_explicit_indices_keep_their_position():
+    selected = select_instances(_instances(), _options('state=running'), indices=[1, 2])
+    assert [(i, inst.id) for i, inst in selected] == [(2, 'i-2')]
+
+def test_invalid_expressions():
+    with pytest.raises(ValueError):
+        Selector(['size=large'])
+    with pytest.raises(ValueError):
+        Selector(['1-x'])
@@ -0,0 +1,61 @@
+from manec2.utils.instance_type import Instance
+from manec2.utils.watch import InstanceTracker, format_elapsed
+
+def _inst(inst_id, state):
+    return Instance(inst_id, 'c5.large', 'us-west-2a', '10.0.0.1', last_state=state)
+
+def test_first_sight_is_not_a_transition():
+    tracker = InstanceTracker()
+    tracker.reconcile({ 'web': [(0, _inst('i-0', 'pending'))] }, now=10)
+
+    assert tracker.transitions() == []
+    assert tracker.transitional_ids() == ['i-0']
+    assert tracker.since['i-0'] == 10
+
+def test_update_records_transitions():
+    tracker = InstanceTracker()
+    tracker.reconcile({ 'web': [(0, _inst('i-0', 'pending')), (1, _inst('i-1', 'running'))] }, now=10)
+    tracker.update([_inst('i-0', 'running')], now=15)
+
+    assert [(ctx, ind, inst.id, previous) for ctx, ind, inst, previous in tracker.transitions()] == \
+        [('web', 0, 'i-0', 'pending')]
+    assert tracker.since['i-0'] == 15
+    assert tracker.since['i-1'] == 10
+    assert tracker.transitional_ids() == []
+
+    ## A transition is only reported by the refresh that saw it
+    tracker.update([_inst('i-0', 'running')], now=20)
+    assert tracker.transitions() == []
+    assert tracker.previous['i-0'] == 'pending'
+
+def test_update_ignores_unwatched_instances():
+    tracker = InstanceTracker()
+    tracker.reconcile({ 'web': [(0, _inst('i-0', 'running'))] }, now=10)
+    tracker.update([_inst('i-9', 'pending')], now=15)
+
+    assert list(tracker.instances) == ['i-0']
+
+def test_reconcile_drops_departed_instances():
+    tracker = InstanceTracker()
+    tracker.reconcile({ 'web': [(0, _inst('i-0', 'stopping')), (1, _inst('i-1', 'running'))] }, now=10)
+    tracker.update([_inst('i-0', 'stopped')], now=15)
+    tracker.reconcile({ 'web': [(1, _inst('i-1', 'running'))] }, now=20)
+
+    assert list(tracker.instances) == ['i-1']
+    for states in (tracker.since, tracker.previous, tracker.changed):
+        assert 'i-0' not in states
+
+def test_render_shows_transition_and_empty_contexts():
+    tracker = InstanceTracker()
+    tracker.reconcile({ 'web': [(0, _inst('i-0', 'pending'))], 'db': [] }, now=0)
+    tracker.update([_inst('i-0', 'running')], now=5)
+    lines = tracker.render(now=65, highlight=False)
+
+    assert lines[0] == "Context 'web'"
+    assert lines[2].split()[-5:] == ['running', '1m00s', 'pending', '->', 'running']
+    assert "Context 'db' has no live instances" in lines
+
+def test_format_elapsed():
+    assert format_elapsed(59) == '59s'
+    assert format_elapsed(61) == '1m01s'
+    assert format_elapsed(3720) == '1h02m'
@@ -0,0 +1,126 @@
+import contextlib
+import os
+import threading
+import time
+
+## Active tracer, None unless --trace was given
+_tracer = None
+
+class Tracer:
+    """
+    Collects complete ('X') events in the Chrome trace event format. Times are
+    microseconds since the tracer was created.
+    """
+    def __init__(self, path, origin=None):
+        self.path = path
+        self.origin = origin if origin is not None else time.perf_counter()
+        self.lock = threading.Lock()
+        self.events = []
+        self.threads = {}
+
+    def _tid(self):
+        ident = threading.get_ident()
+        tid = self.threads.get(ident)
+        if tid is None:
+            tid = len(self.threads)
+            self.threads[ident] = tid
+            self.events.append({ 'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid,
+                'args': { 'name': threading.current_thread().name } })
+
+        return tid
+
+    def add(self, name, cat, start, end, args):
+        with self.lock:
+            self.events.append({
+                'name': name,
+                'cat': cat,
+                'ph': 'X',
+                'ts': round((start - self.origin) * 1e6, 1),
+                'dur': round((end - start) * 1e6, 1),
+                'pid': os.getpid(),
+                'tid': self._tid(),
+                'args': args
+            })
+
+    def write(self):
+        import json
+        with self.lock:
+            with open(self.path, 'w') as trace_file:
+                json.dump({ 'traceEvents': self.events, 'displayTimeUnit': 'ms' }, trace_file)
+
+def start_trace(path, origin=None):
+    """
+    Start recording spans to path. origin is the perf_counter() value the
+    trace starts at, so phases that ran before --trace was parsed still fit.
+    """
+    global _tracer
+    _tracer = Tracer(path, origin)
+
+def finish_trace():
+    """
+    Write the recorded spans, if tracing, and stop recording.
+    """
+    global _tracer
+    if _tracer is not None:
+        _tracer.write()
+        _tracer = None
+
+def tracing():
+    return _tracer is not None
+
+def record_span(name, cat, start, end=None, **args):
+    """
+    Record a span that has already happened. start and end are perf_counter()
+    values, end defaults to now.
+    """
+    if _tracer is not None:
+        _tracer.add(name, cat, start, end if end is not None else time.perf_counter(), args)
+
+@contextlib.contextmanager
+def span(name, cat='phase', **args):
+    """
+    Time the enclosed block as one span. Yields the span's args, so the block
+    can attach results such as exit codes. Does nothing unless tracing.
+    """
+    if _tracer is None:
+        yield args
+        return
+
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        _tracer.add(name, cat, start, time.perf_counter(), args)
+
+def _before_call(model, context, **kwargs):
+    context['manec2_trace'] = (time.perf_counter(), model.name, model.service_model.service_name)
+
+def _after_call(context, parsed=None, exception=None, **kwargs):
+    ## after-call-error is emitted without the operation model
+    started = context.get('manec2_trace')
+    if started is None:
+        return
+
+    start, operation, service = started
+    args = { 'operation': operation, 'service': service }
+    if parsed is not None:
+        metadata = parsed.get('ResponseMetadata', {})
+        args['retries'] = metadata.get('RetryAttempts', 0)
+        args['status'] = metadata.get('HTTPStatusCode')
+        args['next_page'] = 'NextToken' in parsed
+    if exception is not None:
+        args['error'] = type(exception).__name__
+
+    record_span(operation, 'aws', start, **args)
+
+def trace_session(session):
+    """
+    Record a span for every API call made through the clients of a boto3
+    session. Must be called before the session creates its clients.
+    """
+    if _tracer is None:
+        return
+
+    session.events.register('before-call', _before_call)
+    session.events.register('after-call', _after_call)
+    session.events.register('after-call-error', _after_call)
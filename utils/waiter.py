@@ -0,0 +1,160 @@
+import re
+import sys
+import time
+
+from manec2.utils.constants import DESCRIBE_BATCH_SIZE, LIFECYCLE_WAIT_TIMEOUT, RED_TEXT, RESET_TEXT
+
+MIN_POLL_INTERVAL = 2
+MAX_POLL_INTERVAL = 15
+
+## States an instance can not come back from while waiting for the target state
+FAILED_STATES = {
+    'running': ('shutting-down', 'terminated'),
+    'stopped': ('shutting-down', 'terminated'),
+    'terminated': ()
+}
+
+class Poller:
+    """
+    Adaptive poll interval. It resets to the minimum whenever a tick makes
+    progress and backs off while nothing changes.
+    """
+    def __init__(self, timeout):
+        self.start = time.monotonic()
+        self.deadline = self.start + timeout
+        self.interval = MIN_POLL_INTERVAL
+
+    def elapsed(self):
+        return time.monotonic() - self.start
+
+    def sleep(self, progressed):
+        self.interval = MIN_POLL_INTERVAL if progressed \
+            else min(self.interval * 1.5, MAX_POLL_INTERVAL)
+        if time.monotonic() + self.interval > self.deadline:
+            return False
+
+        time.sleep(self.interval)
+        return True
+
+def _describe_batch(ec2_cli, batch):
+    instances = []
+    paginator = ec2_cli.get_paginator('describe_instances')
+    for page in paginator.paginate(InstanceIds=batch):
+        for res in page['Reservations']:
+            instances += res['Instances']
+
+    return instances
+
+def describe_instance_ids(ec2_cli, instance_ids):
+    """
+    describe_instances records of instance_ids, in any state, in batches of
+    DESCRIBE_BATCH_SIZE. IDs EC2 doesn't know, yet or any more, are left out
+    without losing the rest of their batch.
+    """
+    from botocore.exceptions import ClientError
+
+    instances = []
+    for i in range(0, len(instance_ids), DESCRIBE_BATCH_SIZE):
+        batch = instance_ids[i:i + DESCRIBE_BATCH_SIZE]
+        while batch:
+            try:
+                instances += _describe_batch(ec2_cli, batch)
+                break
+            except ClientError as e:
+                ## Freshly launched IDs take a moment to become visible, purged ones are gone
+                if e.response['Error']['Code'] != 'InvalidInstanceID.NotFound':
+                    raise
+
+                ## The message names every unknown ID, retry the batch without them
+                unknown = set(re.findall(r'i-[0-9a-f]+', e.response['Error'].get('Message', '')))
+                if not unknown & set(batch):
+                    break
+                batch = [inst_id for inst_id in batch if inst_id not in unknown]
+
+    return instances
+
+def _describe_states(ec2_cli, instance_ids):
+    return { inst['InstanceId']: inst['State']['Name']
+             for inst in describe_instance_ids(ec2_cli, instance_ids) }
+
+def wait_for_instances(ec2_cli, instance_ids, target_state, timeout=LIFECYCLE_WAIT_TIMEOUT):
+    """
+    Wait until every instance in instance_ids reaches target_state, polling all
+    of them with one batched describe call per tick. Prints every state
+    transition with the time since the wait started. Exits if an instance can no
+    longer reach the target state or the timeout passes.
+    """
+    pending = list(dict.fromkeys(instance_ids))
+    last_states = {}
+    failed = []
+    poller = Poller(timeout)
+
+    print(f'Waiting for {len(pending)} instances to be {target_state}')
+    while pending:
+        states = _describe_states(ec2_cli, pending)
+
+        progressed = False
+        still_pending = []
+        for inst_id in pending:
+            state = states.get(inst_id)
+            if state is not None and state != last_states.get(inst_id):
+                print(f'  {inst_id}  {last_states.get(inst_id, "?")} -> {state}  {poller.elapsed():.1f}s')
+                last_states[inst_id] = state
+                progressed = True
+
+            if state == target_state:
+                continue
+            if state in FAILED_STATES[target_state]:
+                failed.append(inst_id)
+                continue
+
+            still_pending.append(inst_id)
+
+        pending = still_pending
+        if pending and not poller.sleep(progressed):
+            break
+
+    if failed or pending:
+        for inst_id in failed + pending:
+            print(RED_TEXT + f'  {inst_id}  did not reach {target_state} (last seen {last_states.get(inst_id, "unknown")})'
+                + RESET_TEXT, file=sys.stderr)
+        sys.exit(14)
+
+    print(f'All instances {target_state} after {poller.elapsed():.1f}s')
+
+def wait_for_image(ec2_cli, image_id, timeout=LIFECYCLE_WAIT_TIMEOUT):
+    """
+    Wait until image_id is available. Exits if the image fails or the timeout
+    passes.
+    """
+    from botocore.exceptions import ClientError
+
+    poller = Poller(timeout)
+    last_state = None
+    while True:
+        try:
+            desc_image_response = ec2_cli.describe_images(ImageIds=[image_id])
+            current_state = desc_image_response['Images'][0]['State']
+        except IndexError:
+            current_state = None
+        except ClientError as e:
+            ## A freshly created image takes a moment to become visible
+            if e.response['Error']['Code'] != 'InvalidAMIID.NotFound':
+                raise
+            current_state = None
+
+        if current_state == 'available':
+            break
+
+        if current_state not in (None, 'pending'):
+            print(f'Image has status {current_state}. Ending...', file=sys.stderr)
+            sys.exit(13)
+
+        progressed = current_state != last_state
+        last_state = current_state
+        if not poller.sleep(progressed):
+            print(f'Image {image_id} still {current_state} after {poller.elapsed():.1f}s. Ending...',
+                file=sys.stderr)
+            sys.exit(13)
+
+    print(f'Image {image_id} available for use after {poller.elapsed():.1f}s')
@@ -0,0 +1,154 @@
+import sys
+import time
+
+from manec2.utils.constants import HIGHLIGHT_TEXT, RESET_TEXT, WATCH_RECONCILE_INTERVAL
+
+## States an instance only passes through, the only ones re-described between
+## full refreshes
+TRANSITIONAL_STATES = ('pending', 'stopping', 'shutting-down')
+
+CLEAR_SCREEN = '\033[H\033[2J'
+
+def format_elapsed(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f'{seconds}s'
+    if seconds < 3600:
+        return f'{seconds // 60}m{seconds % 60:02d}s'
+
+    return f'{seconds // 3600}h{seconds // 60 % 60:02d}m'
+
+class InstanceTracker:
+    """
+    The watched instances of every context with the time each one entered its
+    current state, the state it came from and the refresh that saw the change.
+    """
+    def __init__(self):
+        self.rows = {}
+        self.instances = {}
+        self.since = {}
+        self.previous = {}
+        self.changed = {}
+        self.refresh = 0
+
+    def _observe(self, inst, now):
+        last = self.instances.get(inst.id)
+        if last is None:
+            self.since[inst.id] = now
+        elif last.last_observed_state != inst.last_observed_state:
+            self.previous[inst.id] = last.last_observed_state
+            self.since[inst.id] = now
+            self.changed[inst.id] = self.refresh
+
+        self.instances[inst.id] = inst
+
+    def reconcile(self, ctx_selected, now):
+        """
+        Replace the watched instances with ctx_selected, a dict mapping each
+        context to its (index, inst) pairs. Instances that left the contexts
+        are dropped.
+        """
+        self.refresh += 1
+        self.rows = {}
+        for ctx, selected in ctx_selected.items():
+            self.rows[ctx] = [(ind, inst.id) for ind, inst in selected]
+            for _, inst in selected:
+                self._observe(inst, now)
+
+        watched = { inst_id for rows in self.rows.values() for _, inst_id in rows }
+        for inst_id in list(self.instances):
+            if inst_id not in watched:
+                for states in (self.instances, self.since, self.previous, self.changed):
+                    states.pop(inst_id, None)
+
+    def update(self, instances, now):
+        """
+        Record the latest state of already watched instances.
+        """
+        self.refresh += 1
+        for inst in instances:
+            if inst.id in self.instances:
+                self._observe(inst, now)
+
+    def transitional_ids(self):
+        return [inst_id for inst_id, inst in self.instances.items()
+                if inst.last_observed_state in TRANSITIONAL_STATES]
+
+    def transitions(self):
+        """
+        (ctx, index, inst, previous state) of every instance whose state changed
+        in the latest refresh.
+        """
+        return [(ctx, ind, self.instances[inst_id], self.previous[inst_id])
+                for ctx, rows in self.rows.items() for ind, inst_id in rows
+                if self.changed.get(inst_id) == self.refresh]
+
+    def render(self, now, highlight=True):
+        lines = []
+        for ctx, rows in self.rows.items():
+            if len(rows) == 0:
+                lines += [f"Context '{ctx}' has no live instances", '']
+                continue
+
+            lines += ["Context '" + ctx + "'", str(len(rows)) + " instances:"]
+            for ind, inst_id in rows:
+                inst = self.instances[inst_id]
+                transition = ''
+                if inst_id in self.previous:
+                    transition = self.previous[inst_id] + ' -> ' + inst.last_observed_state
+                line = "  {:2d}  {}  {}  {}  {:15}  {:15}  {:13}  {:>7}  {}".format(ind, inst.id,
+                    inst.type, inst.placement, inst.pr_ip, inst.pub_ip, inst.last_observed_state,
+                    format_elapsed(now - self.since[inst_id]), transition).rstrip()
+                if highlight and self.changed.get(inst_id) == self.refresh:
+                    line = HIGHLIGHT_TEXT + line + RESET_TEXT
+                lines.append(line)
+            lines.append('')
+
+        return lines
+
+def watch_instances(full_refresh, describe, interval, reconcile_interval=WATCH_RECONCILE_INTERVAL,
+                    out=None):
+    """
+    Show the instances returned by full_refresh until interrupted. full_refresh
+    returns a dict mapping each context to its selected (index, inst) pairs,
+    describe the current instances of a list of instance IDs.
+
+    Between full refreshes, which run every reconcile_interval seconds, only the
+    instances in a transitional state are described again. On a terminal the
+    table is redrawn in place with the latest transitions highlighted,
+    otherwise the table is printed once followed by a line per transition.
+    """
+    out = out or sys.stdout
+    live = out.isatty()
+    tracker = InstanceTracker()
+    start = time.monotonic()
+    last_reconcile = None
+    try:
+        while True:
+            now = time.monotonic()
+            if last_reconcile is None or now - last_reconcile >= reconcile_interval:
+                tracker.reconcile(full_refresh(), now)
+                last_reconcile = now
+            else:
+                transitional = tracker.transitional_ids()
+                if transitional:
+                    tracker.update(describe(transitional), now)
+                else:
+                    tracker.refresh += 1
+
+            if live:
+                header = f'Every {interval:g}s, full refresh every {reconcile_interval:g}s. ' + \
+                    f'{len(tracker.transitional_ids())} instances in transition, ' + \
+                    f'watching for {format_elapsed(now - start)}. Ctrl-C to stop'
+                out.write(CLEAR_SCREEN + '\n'.join([header, ''] + tracker.render(now)) + '\n')
+            elif last_reconcile == now and tracker.refresh == 1:
+                out.write('\n'.join(tracker.render(now, highlight=False)) + '\n')
+            else:
+                for ctx, ind, inst, previous in tracker.transitions():
+                    out.write(f'  {ctx}  {ind}  {inst.id}  {previous} -> {inst.last_observed_state}  ' +
+                        f'{format_elapsed(now - start)}\n')
+            out.flush()
+
+            time.sleep(max(0, interval - (time.monotonic() - now)))
+    except KeyboardInterrupt:
+        pass